@@ -0,0 +1,275 @@
+# archive.py
+# Durable, append-only metric archive made of fixed-width, memory-mapped segment files.
+#
+# Each segment covers a fixed time window and is laid out column by column:
+# a 4 KB header followed by one float64 column for timestamps and one per metric,
+# each `capacity` slots long. Rows are appended by writing every column slot first
+# and bumping the row count in the header last, so readers never see partial rows.
+# Samples are buffered in memory and written out by flush(), which is meant to run
+# in a worker thread so the sampler never waits on the disk. Other processes can open
+# the same directory read-only and see new rows as they are written.
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+MAGIC = b'STATSEG1'
+HEADER_SIZE = 4096
+# magic, column count, capacity, row count, segment start
+HEADER_FORMAT = '<8sIIQd'
+NAMES_OFFSET = struct.calcsize(HEADER_FORMAT)
+COUNT_OFFSET = 16
+SEGMENT_SUFFIX = '.seg'
+
+class Segment:
+    """One memory-mapped segment file holding up to `capacity` rows."""
+
+    def __init__(self, path, names=None, start=None, capacity=None, readonly=False):
+        self.path = path
+        if names is not None:
+            self._create(names, start, capacity)
+        with open(path, 'rb' if readonly else 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        if len(self.map) < HEADER_SIZE:
+            self.map.close()
+            raise ValueError(f"{path} is not a stats archive segment")
+        magic, columns, self.capacity, self.count, self.start = struct.unpack_from(HEADER_FORMAT, self.map)
+        # A segment another process is still creating may not have its full size yet
+        if magic != MAGIC or len(self.map) != HEADER_SIZE + 8 * self.capacity * columns:
+            self.map.close()
+            raise ValueError(f"{path} is not a complete stats archive segment")
+        (length,) = struct.unpack_from('<I', self.map, NAMES_OFFSET)
+        self.names = json.loads(self.map[NAMES_OFFSET + 4:NAMES_OFFSET + 4 + length])
+        self.view = memoryview(self.map)[HEADER_SIZE:].cast('d')
+        # Reads in progress; a segment expired during a read is closed when the last one ends
+        self.readers = 0
+        self.retired = False
+
+    def _create(self, names, start, capacity):
+        encoded = json.dumps(names).encode()
+        if NAMES_OFFSET + 4 + len(encoded) > HEADER_SIZE:
+            raise ValueError("too many metric names for the segment header")
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, len(names) + 1, capacity, 0, start))
+            f.write(struct.pack('<I', len(encoded)) + encoded)
+            # Preallocate the whole segment so appends never grow the file
+            f.truncate(HEADER_SIZE + 8 * capacity * (len(names) + 1))
+
+    @property
+    def end(self):
+        return self.view[self.count - 1] if self.count else self.start
+
+    def reload_count(self):
+        """Pick up rows appended by the writing process."""
+        (self.count,) = struct.unpack_from('<Q', self.map, COUNT_OFFSET)
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, timestamp, values):
+        row = self.count
+        self.view[row] = timestamp
+        for column, value in enumerate(values, 1):
+            self.view[column * self.capacity + row] = value
+        self.count = row + 1
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+
+    def column(self, index, first=0, stop=None):
+        """Zero-copy view of rows [first, stop) of a column; 0 is the timestamp column."""
+        stop = self.count if stop is None else stop
+        offset = index * self.capacity
+        return self.view[offset + first:offset + stop]
+
+    def rows_between(self, start, end):
+        timestamps = self.column(0)
+        return bisect_left(timestamps, start), bisect_right(timestamps, end)
+
+    def sync(self):
+        self.map.flush()
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # A reader still holds a slice; the mapping goes away with it
+            pass
+
+class Archive:
+    """Time-rotated segments in one directory, with batched writes and retention.
+
+    With readonly=True the archive only reads what another process writes there.
+    """
+
+    def __init__(self, directory, names, interval=1, segment_seconds=3600, retention_seconds=7 * 86400,
+                 readonly=False):
+        self.directory = directory
+        self.readonly = readonly
+        self.names = list(names)
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        # Room for the whole window at the sample interval, plus slack for early ticks
+        self.capacity = int(segment_seconds / interval * 1.25) + 1
+        self.pending = []
+        self.lock = threading.Lock()  # Guards pending, segments and segment reader counts
+        self.write_lock = threading.Lock()  # Serializes flush() calls
+        self.segments = {}  # start -> Segment, opened lazily for reads
+        self.current = None
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+            self._resume()
+
+    def _segment_path(self, start):
+        return os.path.join(self.directory, f"{int(start)}{SEGMENT_SUFFIX}")
+
+    def _segment_starts(self):
+        starts = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return starts  # A read-only archive whose writer hasn't started yet
+        for name in names:
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    starts.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(starts)
+
+    def _open(self, start):
+        with self.lock:
+            if start not in self.segments:
+                self.segments[start] = Segment(self._segment_path(start))
+            return self.segments[start]
+
+    def _acquire(self, start):
+        """Open a segment for reading and keep expire() from closing it until _release()."""
+        with self.lock:
+            if start not in self.segments:
+                self.segments[start] = Segment(self._segment_path(start), readonly=self.readonly)
+            segment = self.segments[start]
+            if self.readonly:
+                segment.reload_count()
+            segment.readers += 1
+            return segment
+
+    def _release(self, segment):
+        with self.lock:
+            segment.readers -= 1
+            if segment.retired and not segment.readers:
+                segment.close()
+
+    def _retire(self, segment):
+        # Caller holds self.lock
+        if segment.readers:
+            segment.retired = True
+        else:
+            segment.close()
+
+    def _resume(self):
+        # Keep appending to the newest segment if it is still in its window
+        starts = self._segment_starts()
+        if not starts:
+            return
+        try:
+            segment = self._open(starts[-1])
+        except (OSError, ValueError):
+            return
+        if (segment.names == self.names and not segment.full()
+                and time.time() < segment.start + self.segment_seconds):
+            self.current = segment
+
+    def append(self, timestamp, values):
+        """Queue one sample; cheap enough to call from the event loop."""
+        if self.readonly:
+            raise ValueError("archive is read-only")
+        with self.lock:
+            self.pending.append((timestamp, tuple(values)))
+
+    def flush(self):
+        """Write queued samples, sync them to disk and apply retention. Blocking."""
+        if self.readonly:
+            return 0
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return 0
+            for timestamp, values in pending:
+                segment = self.current
+                if segment is None or segment.full() or timestamp >= segment.start + self.segment_seconds:
+                    if segment is not None:
+                        segment.sync()
+                    start = int(timestamp - timestamp % self.segment_seconds)
+                    if os.path.exists(self._segment_path(start)):
+                        # The window's segment filled up early or belongs to another metric set
+                        start = int(timestamp)
+                        while os.path.exists(self._segment_path(start)):
+                            start += 1
+                    segment = Segment(self._segment_path(start), self.names, start, self.capacity)
+                    with self.lock:
+                        self.segments[start] = segment
+                    self.current = segment
+                segment.append(timestamp, values)
+            self.current.sync()
+            self.expire()
+            return len(pending)
+
+    def expire(self, now=None):
+        """Delete segments whose whole window is older than the retention period."""
+        cutoff = (now or time.time()) - self.retention_seconds
+        for start in self._segment_starts():
+            if start + self.segment_seconds >= cutoff:
+                break
+            with self.lock:
+                segment = self.segments.pop(start, None)
+                if segment is not None:
+                    self._retire(segment)
+            try:
+                os.remove(self._segment_path(start))
+            except OSError:
+                pass
+
+    def read(self, start, end, names=None):
+        """Yield (timestamps, {name: values}) zero-copy column slices per segment in [start, end].
+
+        The slices are only valid until the generator advances; copy what you keep.
+        """
+        wanted = [(i + 1, name) for i, name in enumerate(self.names) if names is None or name in names]
+        starts = self._segment_starts()
+        if self.readonly:
+            # Let go of segments the writing process has since expired
+            with self.lock:
+                for gone in set(self.segments) - set(starts):
+                    self._retire(self.segments.pop(gone))
+        for segment_start in starts:
+            if segment_start > end or segment_start + self.segment_seconds < start:
+                continue
+            try:
+                segment = self._acquire(segment_start)
+            except (OSError, ValueError):
+                continue
+            slices = []
+            try:
+                if segment.names != self.names:
+                    continue
+                first, stop = segment.rows_between(start, end)
+                if first >= stop:
+                    continue
+                slices = [segment.column(i, first, stop) for i in [0] + [i for i, _ in wanted]]
+                yield slices[0], {name: view for (_, name), view in zip(wanted, slices[1:])}
+            finally:
+                for view in slices:
+                    view.release()
+                self._release(segment)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            for segment in self.segments.values():
+                self._retire(segment)
+            self.segments.clear()
+        self.current = None
@@ -0,0 +1,119 @@
+# assets.py
+# Dashboard files served from memory, precompressed with gzip and (when installed) brotli.
+# A file is read and compressed once, then again only after its mtime or size changes;
+# every request costs one stat() and a dictionary lookup.
+import gzip
+import hashlib
+import os
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred order when the client accepts several encodings
+ENCODINGS = ('br', 'gzip', 'identity')
+
+def accepted_encodings(header):
+    """Return the content codings allowed by an Accept-Encoding header."""
+    accepted = {'identity'}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    accepted.discard(coding)
+                    continue
+            except ValueError:
+                continue
+        if coding == '*':
+            accepted.update(ENCODINGS)
+        elif coding:
+            accepted.add(coding)
+    return accepted
+
+def etag_matches(header, etag):
+    """True when an If-None-Match header lists etag (or *); weak tags compare by value."""
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+class Asset:
+    """One file held in memory in every encoding worth serving, with a strong ETag each."""
+
+    def __init__(self, path, media_type, transform=None, depends=()):
+        self.path = path
+        self.media_type = media_type
+        # Optional bytes -> bytes rewrite applied before compressing, e.g. versioned URLs
+        self.transform = transform
+        # Assets the transform reads from; a change in any of them reloads this one too
+        self.depends = depends
+        self.key = None
+        self.version = None
+        self.bodies = {}
+        self.etags = {}
+
+    @classmethod
+    def from_bytes(cls, body, media_type):
+        """An asset with no backing file, compressed once from body and never reloaded."""
+        asset = cls(None, media_type)
+        asset.load(body)
+        return asset
+
+    def refresh(self):
+        """Reload the file if it changed since the last load. Raises OSError if it is missing."""
+        if self.path is None:
+            return False
+        for asset in self.depends:
+            try:
+                asset.refresh()
+            except OSError:
+                pass
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size, tuple(asset.version for asset in self.depends))
+        if key == self.key:
+            return False
+        with open(self.path, 'rb') as f:
+            body = f.read()
+        if self.transform is not None:
+            body = self.transform(body)
+        self.load(body)
+        self.key = key
+        return True
+
+    def load(self, body):
+        digest = hashlib.sha1(body).hexdigest()
+        bodies = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            bodies['br'] = brotli.compress(body, quality=11)
+        # Tiny files can come out larger compressed; only keep encodings that pay off
+        self.bodies = {coding: data for coding, data in bodies.items()
+                       if coding == 'identity' or len(data) < len(body)}
+        # Each encoding is a different representation, so each gets its own strong ETag
+        self.etags = {coding: f'"{digest}"' if coding == 'identity' else f'"{digest}-{coding}"'
+                      for coding in self.bodies}
+        self.version = digest[:12]
+
+    def response(self, request, cache_control='no-cache'):
+        try:
+            self.refresh()
+        except OSError:
+            if not self.bodies:
+                raise HTTPException(status_code=404, detail="Not found")
+            # Keep serving the copy in memory while the file is being replaced
+        accepted = accepted_encodings(request.headers.get('accept-encoding', ''))
+        coding = next((c for c in ENCODINGS if c in self.bodies and c in accepted), 'identity')
+        headers = {
+            'ETag': self.etags[coding],
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if coding != 'identity':
+            headers['Content-Encoding'] = coding
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None and etag_matches(if_none_match, self.etags[coding]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.bodies[coding], media_type=self.media_type, headers=headers)
@@ -0,0 +1,263 @@
+# benchmark.py
+# Benchmarks for the Linux app: each collector, collect_stats(), frame encoding and the
+# per-client send path. By default they run against a FakeHost (see fakehost.py), so
+# results only depend on the code and the CPU, not on what the machine is doing.
+#
+#   python benchmark.py                          # synthetic host: 5000 processes, 50k sockets, 256 CPUs
+#   python benchmark.py --backend real           # this machine, through psutil and /proc
+#   python benchmark.py --output results.json    # also write machine-readable results
+#   python benchmark.py --compare results.json   # show ratios against an earlier run
+#   python benchmark.py --compare results.json --max-regression 1.2   # exit 1 if anything got >20% slower
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+def summarize(samples, **extra):
+    """Summary of a list of durations in seconds, in milliseconds."""
+    ordered = sorted(samples)
+    result = {
+        'iterations': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 4),
+        'median_ms': round(statistics.median(ordered) * 1000, 4),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        'min_ms': round(ordered[0] * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+    }
+    result.update(extra)
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def load_app(args, workdir):
+    """Import main.py on top of the selected backend and return the module."""
+    os.environ.setdefault('STATS_ARCHIVE_DIR', '')
+    host = None
+    if args.backend == 'fake':
+        import fakehost
+        host = fakehost.FakeHost(args.processes, args.sockets, args.cpus, seed=args.seed)
+        # main.py reads CPU counts and boot time at import, so the fake goes in first
+        sys.modules['psutil'] = host
+    import main
+    import procnet
+    if host is not None:
+        procnet.PROC_NET_FILES = host.write_proc_net(workdir)
+        reply = '\n\n'.join('ActiveState=active' for _ in main.SERVICES) + '\n'
+
+        async def run_command_output(*args):
+            return reply
+        main.run_command_output = run_command_output
+    # Every collector refreshes on every call, and nothing is cut short by a budget
+    for name in main.COLLECTORS:
+        main.COLLECTOR_INTERVALS[name] = 0
+        main.COLLECTOR_BUDGETS[name] = 3600
+    return main
+
+class NullWebSocket:
+    """Accepts sends instantly, so only the server-side cost of a send is measured."""
+
+    async def send_text(self, data):
+        pass
+
+    async def send_bytes(self, data):
+        pass
+
+async def bench_collectors(main, iterations):
+    results = {}
+    loop = asyncio.get_running_loop()
+    for name, func in main.COLLECTORS.items():
+        samples = []
+        for i in range(iterations + 1):
+            started = time.perf_counter()
+            if asyncio.iscoroutinefunction(func):
+                result = await func()
+            else:
+                result = await loop.run_in_executor(main.collector_executor, func)
+            if i:  # The first call fills caches such as the process table
+                samples.append(time.perf_counter() - started)
+        count = main.COLLECTOR_ITEMS.get(name)
+        results[f'collector.{name}'] = summarize(samples, items=count(result) if count else None)
+    return results
+
+async def bench_collect_stats(main, iterations):
+    await main.initialize_static_data()
+    samples = []
+    stats = None
+    for i in range(iterations + 1):
+        started = time.perf_counter()
+        stats = await main.collect_stats()
+        if i:
+            samples.append(time.perf_counter() - started)
+    return {'collect_stats': summarize(samples)}, stats
+
+def frame_variants(main):
+    top25_v2 = ('cpu', 25, 2, None)
+    variants = [
+        ('full.v1.json', 'full', main.DEFAULT_VIEW, 'json'),
+        ('full.v2.top25.json', 'full', top25_v2, 'json'),
+        ('keyframe.v2.top25.json', 'keyframe', top25_v2, 'json'),
+        ('delta.v2.top25.json', 'delta', top25_v2, 'json'),
+        ('delta.v2.cpu_memory.json', 'delta', ('cpu', 0, 2, main.resolve_fields('cpu,memory')), 'json'),
+    ]
+    for encoding in ('msgpack', 'cbor'):
+        if encoding in main.SUBPROTOCOLS.values():
+            variants.append((f'keyframe.v2.top25.{encoding}', 'keyframe', top25_v2, encoding))
+    return variants
+
+async def sample_pair(main):
+    first = await main.collect_stats()
+    second = await main.collect_stats()
+    return first, second
+
+def bench_frames(main, first, second, iterations):
+    results = {}
+    for label, kind, view, encoding in frame_variants(main):
+        samples = []
+        for seq in range(iterations):
+            # A fresh pair of frames each time, so nothing comes from the per-frame cache
+            frame = main.Frame(2 * seq + 2, second, main.Frame(2 * seq + 1, first))
+            started = time.perf_counter()
+            data = frame.encode(kind, view, encoding)
+            samples.append(time.perf_counter() - started)
+        results[f'frame.{label}'] = summarize(samples, bytes=len(data))
+    return results
+
+def bench_history(main, stats, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        main.record_history(stats)
+        samples.append(time.perf_counter() - started)
+    return {'history.record': summarize(samples)}
+
+async def bench_send(main, first, second, clients, iterations):
+    """Time one tick's fan-out: every client picks its message and sends it."""
+    websocket = NullWebSocket()
+    # Delta clients spread over a few views and encodings
+    mixed = [
+        (('cpu', 25, 2, None), 'json'),
+        (('mem', 10, 2, None), 'json'),
+        (('cpu', 0, 2, main.resolve_fields('cpu,memory,network')), 'json'),
+        (('cpu', 25, 2, None), 'msgpack' if main.msgpack else 'json'),
+    ]
+    setups = {
+        # Every client on the default view shares one encoding per tick
+        'shared': [('full', main.DEFAULT_VIEW, 'json')] * clients,
+        'mixed': [('delta', *mixed[i % len(mixed)]) for i in range(clients)],
+    }
+    results = {}
+    for label, subscribers in setups.items():
+        client_state = [{'counters': main.new_client_counters()} for _ in subscribers]
+        samples = []
+        for seq in range(iterations):
+            frame = main.Frame(2 * seq + 2, second, main.Frame(2 * seq + 1, first))
+            started = time.perf_counter()
+            for (kind, view, encoding), client in zip(subscribers, client_state):
+                await main.send_data(websocket, client, frame.encode(kind, view, encoding))
+            samples.append(time.perf_counter() - started)
+        per_client_us = statistics.fmean(samples) / clients * 1e6
+        results[f'send.{label}.{clients}'] = summarize(samples, per_client_us=round(per_client_us, 3))
+    return results
+
+async def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(args, workdir)
+        results.update(await bench_collectors(main, args.iterations))
+        collect_results, stats = await bench_collect_stats(main, args.iterations)
+        results.update(collect_results)
+        first, second = await sample_pair(main)
+        results.update(bench_frames(main, first, second, args.iterations))
+        results.update(bench_history(main, stats, args.iterations))
+        results.update(await bench_send(main, first, second, args.clients, args.iterations))
+        main.collector_executor.shutdown(wait=False)
+        main.mount_executor.shutdown(wait=False)
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'processes': args.processes if args.backend == 'fake' else None,
+            'sockets': args.sockets if args.backend == 'fake' else None,
+            'cpus': args.cpus if args.backend == 'fake' else os.cpu_count(),
+            'iterations': args.iterations,
+            'clients': args.clients,
+        },
+        'results': results,
+    }
+
+def print_report(report, baseline=None):
+    print(f"{'benchmark':<40} {'mean ms':>10} {'p95 ms':>10}" + (f" {'base ms':>10} {'ratio':>7}" if baseline else ''),
+          file=sys.stderr)
+    base_results = baseline['results'] if baseline else {}
+    for name, result in report['results'].items():
+        line = f"{name:<40} {result['mean_ms']:>10.3f} {result['p95_ms']:>10.3f}"
+        if name in base_results:
+            base = base_results[name]['mean_ms']
+            line += f" {base:>10.3f} {result['mean_ms'] / base if base else float('inf'):>7.2f}"
+        print(line, file=sys.stderr)
+
+def regressions(report, baseline, max_ratio):
+    """Benchmarks whose mean time grew by more than max_ratio against the baseline."""
+    found = {}
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base and base['mean_ms'] > 0:
+            ratio = result['mean_ms'] / base['mean_ms']
+            if ratio > max_ratio:
+                found[name] = round(ratio, 2)
+    return found
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stats collectors and frame pipeline.")
+    parser.add_argument('--backend', choices=('fake', 'real'), default='fake')
+    parser.add_argument('--processes', type=int, default=5000)
+    parser.add_argument('--sockets', type=int, default=50000)
+    parser.add_argument('--cpus', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--output', help="write the results as JSON to this file ('-' for stdout)")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--max-regression', type=float,
+                        help="with --compare, exit with status 1 if any mean exceeds this ratio to the baseline")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.max_regression is not None and not args.compare:
+        sys.exit("--max-regression needs --compare")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.max_regression is not None:
+        slower = regressions(report, baseline, args.max_regression)
+        for name, ratio in slower.items():
+            print(f"REGRESSION {name}: {ratio}x the baseline (limit {args.max_regression}x)", file=sys.stderr)
+        if slower:
+            sys.exit(1)
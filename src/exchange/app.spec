@@ -4,7 +4,7 @@
 block_cipher = None
 
 a = Analysis(['main.py'],
-             pathex=['.'],
+             pathex=['.', '..'],
              binaries=[],
              datas=[('templates', 'templates')],
              hiddenimports=[
@@ -0,0 +1,199 @@
+# fakehost.py
+# A deterministic synthetic host that stands in for psutil, for benchmarks.
+# FakeHost implements the subset of the psutil API that main.py uses and writes
+# /proc/net style socket tables to a directory, so procnet parses real text.
+# Every value comes from a seeded generator and each call advances the host by
+# one step (CPU load moves, a few processes start and exit, counters grow), so
+# two runs with the same parameters see exactly the same sequence of samples.
+import os
+import random
+import socket
+from collections import namedtuple
+from contextlib import contextmanager
+
+svmem = namedtuple('svmem', 'total available percent used free')
+sswap = namedtuple('sswap', 'total used free percent sin sout')
+sdiskusage = namedtuple('sdiskusage', 'total used free percent')
+sdiskio = namedtuple('sdiskio', 'read_count write_count read_bytes write_bytes read_time write_time')
+snetio = namedtuple('snetio', 'bytes_sent bytes_recv packets_sent packets_recv errin errout dropin dropout')
+sdiskpart = namedtuple('sdiskpart', 'device mountpoint fstype opts')
+scpufreq = namedtuple('scpufreq', 'current min max')
+suser = namedtuple('suser', 'name terminal host started pid')
+pcputimes = namedtuple('pcputimes', 'user system children_user children_system')
+
+class Error(Exception):
+    pass
+
+class NoSuchProcess(Error):
+    pass
+
+class ZombieProcess(NoSuchProcess):
+    pass
+
+class AccessDenied(Error):
+    pass
+
+PROCESS_NAMES = ('nginx', 'php-fpm', 'mariadbd', 'python3', 'java', 'node', 'redis-server',
+                 'sshd', 'systemd', 'postgres', 'elasticsearch', 'cron', 'rsyslogd', 'bash')
+
+class FakeProcess:
+    def __init__(self, host, pid, create_time, name):
+        self._host = host
+        self.pid = pid
+        self._create_time = create_time
+        self._name = name
+        self._denied = pid % 97 == 0  # A few processes behave like ones owned by another user
+
+    @contextmanager
+    def oneshot(self):
+        yield
+
+    def create_time(self):
+        return self._create_time
+
+    def name(self):
+        return self._name
+
+    def cpu_percent(self, interval=None):
+        if self._denied:
+            raise AccessDenied()
+        return self._host.process_cpu(self.pid)
+
+    def memory_percent(self):
+        return self._host.process_memory(self.pid)
+
+    def cpu_times(self):
+        return pcputimes(1.0, 0.5, 0.0, 0.0)
+
+class FakeHost:
+    """Synthetic host with a fixed shape; pass it where main.py expects the psutil module."""
+
+    Error = Error
+    NoSuchProcess = NoSuchProcess
+    ZombieProcess = ZombieProcess
+    AccessDenied = AccessDenied
+
+    def __init__(self, processes=5000, sockets=50000, cpus=256, disks=16, seed=1):
+        self.rng = random.Random(seed)
+        self.cpus = cpus
+        self.step = 0
+        self.next_pid = 1
+        self.processes = [self._spawn() for _ in range(processes)]
+        self.socket_count = sockets
+        self.disks = [f"nvme{i}n1" for i in range(disks)]
+        self.disk_io = {name: [0, 0, 0, 0] for name in self.disks}
+        self.net_io = [0, 0]
+
+    def _spawn(self):
+        pid = self.next_pid
+        self.next_pid += 1
+        return FakeProcess(self, pid, 1_700_000_000.0 + pid, self.rng.choice(PROCESS_NAMES))
+
+    # Deterministic per-process values that change with every step
+    def process_cpu(self, pid):
+        return float((pid * 7919 + self.step * 104729) % 1000) / 10
+
+    def process_memory(self, pid):
+        return float((pid * 6151 + self.step) % 500) / 100
+
+    # psutil API
+    def process_iter(self, attrs=None):
+        # One step of churn: about 0.5% of the processes exit and as many start
+        self.step += 1
+        churn = max(1, len(self.processes) // 200)
+        for _ in range(churn):
+            self.processes.pop(self.rng.randrange(len(self.processes)))
+            self.processes.append(self._spawn())
+        return iter(list(self.processes))
+
+    def Process(self, pid=None):
+        return FakeProcess(self, pid or os.getpid(), 1_700_000_000.0, 'python3')
+
+    def boot_time(self):
+        return 1_700_000_000.0
+
+    def cpu_count(self, logical=True):
+        return self.cpus
+
+    def cpu_percent(self, interval=None, percpu=False):
+        values = [float((i * 37 + self.step * 11) % 1000) / 10 for i in range(self.cpus)]
+        return values if percpu else round(sum(values) / len(values), 1)
+
+    def cpu_freq(self):
+        return scpufreq(2400.0, 800.0, 3800.0)
+
+    def users(self):
+        return [suser('root', 'pts/0', '10.0.0.1', 1_700_000_000.0, 1)]
+
+    def virtual_memory(self):
+        total = 512 * 2 ** 30
+        used = total // 2 + self.step % 1024 * 2 ** 20
+        return svmem(total, total - used, round(used / total * 100, 1), used, total - used)
+
+    def swap_memory(self):
+        total = 16 * 2 ** 30
+        return sswap(total, total // 10, total - total // 10, 10.0, 0, 0)
+
+    def net_io_counters(self, pernic=False):
+        self.net_io[0] += 1_250_000
+        self.net_io[1] += 5_000_000
+        return snetio(self.net_io[0], self.net_io[1], 0, 0, 0, 0, 0, 0)
+
+    def disk_io_counters(self, perdisk=False):
+        for i, name in enumerate(self.disks):
+            counters = self.disk_io[name]
+            counters[0] += 100 + i
+            counters[1] += 200 + i
+            counters[2] += (100 + i) * 4096
+            counters[3] += (200 + i) * 4096
+        if perdisk:
+            return {name: sdiskio(*c, 0, 0) for name, c in self.disk_io.items()}
+        totals = [sum(c[i] for c in self.disk_io.values()) for i in range(4)]
+        return sdiskio(*totals, 0, 0)
+
+    def disk_partitions(self, all=False):
+        parts = [sdiskpart('/dev/nvme0n1p1', '/', 'ext4', 'rw'),
+                 sdiskpart('proc', '/proc', 'proc', 'rw')]
+        parts += [sdiskpart(f'/dev/{name}', f'/data/{i}', 'xfs', 'rw') for i, name in enumerate(self.disks[1:], 1)]
+        return parts
+
+    def disk_usage(self, path):
+        total = 2 * 2 ** 40
+        used = total // 3
+        return sdiskusage(total, used, total - used, round(used / total * 100, 1))
+
+    def net_connections(self, kind='inet'):
+        raise AccessDenied()  # Sockets are served through write_proc_net() instead
+
+    def write_proc_net(self, directory):
+        """Write tcp/tcp6/udp/udp6 tables to directory and return a procnet.PROC_NET_FILES mapping."""
+        rng = random.Random(self.socket_count)
+        shares = {'tcp': 0.6, 'tcp6': 0.25, 'udp': 0.1, 'udp6': 0.05}
+        families = {'tcp': (socket.AF_INET, socket.SOCK_STREAM), 'tcp6': (socket.AF_INET6, socket.SOCK_STREAM),
+                    'udp': (socket.AF_INET, socket.SOCK_DGRAM), 'udp6': (socket.AF_INET6, socket.SOCK_DGRAM)}
+        header = ('  sl  local_address rem_address   st tx_queue rx_queue tr tm->when '
+                  'retrnsmt   uid  timeout inode\n')
+        files = {}
+        for proto, share in shares.items():
+            path = os.path.join(directory, proto)
+            ipv6 = proto.endswith('6')
+            with open(path, 'w') as f:
+                f.write(header)
+                for i in range(int(self.socket_count * share)):
+                    local = self._hex_address(rng, ipv6, rng.choice((80, 443, 3306, 6379, 9200)))
+                    if proto.startswith('udp'):
+                        remote, state = self._hex_address(None, ipv6, 0), '07'
+                    else:
+                        remote = self._hex_address(rng, ipv6, rng.randrange(1024, 65536))
+                        state = rng.choice(('01', '01', '01', '06', '08', '0A'))
+                    f.write(f"{i:4d}: {local} {remote} {state} 00000000:00000000 00:00000000 "
+                            f"00000000     0        0 {100000 + i} 1 0000000000000000 20 4 30 10 -1\n")
+            files[proto] = (path, *families[proto])
+        return files
+
+    @staticmethod
+    def _hex_address(rng, ipv6, port):
+        words = 4 if ipv6 else 1
+        if rng is None:
+            return '0' * 8 * words + ':0000'
+        return ''.join(f"{rng.getrandbits(32):08X}" for _ in range(words)) + f":{port:04X}"
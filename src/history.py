@@ -0,0 +1,200 @@
+# history.py
+# In-memory metric history kept in fixed-size, array-backed ring buffers.
+# Memory use is fixed when the history is created: 8 bytes per metric per slot
+# for raw samples, plus downsampled rollup tiers stored as float32.
+from array import array
+from bisect import bisect_left, bisect_right
+
+class RingBuffer:
+    """Fixed-capacity ring of float samples stored in a flat array."""
+
+    def __init__(self, capacity, typecode='d'):
+        self.capacity = capacity
+        self.values = array(typecode, bytes(array(typecode).itemsize * capacity))
+        self.count = 0
+        self.index = 0  # Next slot to write
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self, n):
+        """Return up to the last n samples in chronological order."""
+        n = min(n, self.count)
+        start = (self.index - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.values[start:start + n].tolist()
+        return (self.values[start:] + self.values[:self.index]).tolist()
+
+class MetricHistory:
+    """A shared timestamp ring plus one value ring per metric name."""
+
+    def __init__(self, names, capacity):
+        self.names = list(names)
+        self.capacity = capacity
+        self.timestamps = RingBuffer(capacity)
+        self.series = [RingBuffer(capacity) for _ in self.names]
+
+    @property
+    def nbytes(self):
+        return 8 * self.capacity * (len(self.names) + 1)
+
+    def record(self, timestamp, values):
+        """Append one sample; values is a sequence aligned with self.names."""
+        self.timestamps.append(timestamp)
+        for ring, value in zip(self.series, values):
+            ring.append(value)
+
+    def since(self, start, names=None):
+        """Return the samples taken at or after start, as one columnar dict."""
+        timestamps = self.timestamps.last(self.timestamps.count)
+        # Timestamps only ever increase, so skip straight to the first one in range
+        first = bisect_left(timestamps, start)
+        n = len(timestamps) - first
+        return {
+            'timestamps': timestamps[first:],
+            'series': {
+                name: ring.last(n) for name, ring in zip(self.names, self.series)
+                if names is None or name in names
+            },
+        }
+
+# Aggregates kept for every rollup bucket
+ROLLUP_FIELDS = ('min', 'max', 'avg', 'last')
+
+class RollupTier:
+    """Fixed-resolution buckets with min/max/avg/last per metric, updated as samples arrive."""
+
+    def __init__(self, names, resolution, capacity):
+        self.names = list(names)
+        self.resolution = resolution
+        self.capacity = capacity
+        self.starts = RingBuffer(capacity)
+        self.rings = {field: [RingBuffer(capacity, 'f') for _ in self.names] for field in ROLLUP_FIELDS}
+        # Accumulators for the bucket currently being filled
+        self.bucket = None
+        self.count = 0
+        self.min = array('d', bytes(8 * len(self.names)))
+        self.max = array('d', bytes(8 * len(self.names)))
+        self.sum = array('d', bytes(8 * len(self.names)))
+        self.last = array('d', bytes(8 * len(self.names)))
+
+    @property
+    def nbytes(self):
+        return self.capacity * (8 + 4 * len(ROLLUP_FIELDS) * len(self.names))
+
+    def add(self, timestamp, values):
+        bucket = timestamp - timestamp % self.resolution
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+        if self.count == 0:
+            for i, value in enumerate(values):
+                self.min[i] = self.max[i] = self.sum[i] = self.last[i] = value
+        else:
+            for i, value in enumerate(values):
+                if value < self.min[i]:
+                    self.min[i] = value
+                if value > self.max[i]:
+                    self.max[i] = value
+                self.sum[i] += value
+                self.last[i] = value
+        self.count += 1
+
+    def flush(self):
+        """Close the current bucket and append its aggregates to the rings."""
+        if not self.count:
+            return
+        self.starts.append(self.bucket)
+        rings = self.rings
+        for i in range(len(self.names)):
+            rings['min'][i].append(self.min[i])
+            rings['max'][i].append(self.max[i])
+            rings['avg'][i].append(self.sum[i] / self.count)
+            rings['last'][i].append(self.last[i])
+        self.count = 0
+
+    def query(self, start, end, names=None):
+        """Return the buckets starting in [start, end], including the open one, as columns."""
+        starts = self.starts.last(self.starts.count)
+        first = bisect_left(starts, start - start % self.resolution)
+        stop = max(first, bisect_right(starts, end))
+        n = len(starts) - first
+        wanted = [i for i, name in enumerate(self.names) if names is None or name in names]
+        result = {
+            'resolution': self.resolution,
+            'timestamps': starts[first:stop],
+            'series': {
+                self.names[i]: {field: self.rings[field][i].last(n)[:stop - first] for field in ROLLUP_FIELDS}
+                for i in wanted
+            },
+        }
+        # The bucket still being filled is part of the answer too
+        if self.count and start <= self.bucket + self.resolution and self.bucket <= end:
+            result['timestamps'].append(float(self.bucket))
+            for i in wanted:
+                series = result['series'][self.names[i]]
+                series['min'].append(self.min[i])
+                series['max'].append(self.max[i])
+                series['avg'].append(self.sum[i] / self.count)
+                series['last'].append(self.last[i])
+        return result
+
+class Rollups:
+    """Several rollup tiers fed from the same samples, e.g. 10 s, 1 min and 1 h buckets."""
+
+    def __init__(self, names, tiers):
+        self.tiers = {resolution: RollupTier(names, resolution, capacity) for resolution, capacity in tiers}
+
+    @property
+    def nbytes(self):
+        return sum(tier.nbytes for tier in self.tiers.values())
+
+    def add(self, timestamp, values):
+        for tier in self.tiers.values():
+            tier.add(timestamp, values)
+
+    def query(self, start, end, resolution, names=None):
+        """Query the finest tier whose resolution is at least the one requested."""
+        candidates = [r for r in sorted(self.tiers) if r >= resolution] or [max(self.tiers)]
+        return self.tiers[candidates[0]].query(start, end, names)
+
+def lttb(xs, ys, threshold):
+    """Downsample a series to at most threshold points with largest-triangle-three-buckets.
+
+    The first and last points are always kept; every bucket in between contributes the
+    point forming the largest triangle with the previously kept point and the average
+    of the next bucket. Returns two lists.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(xs), list(ys)
+    every = (n - 2) / (threshold - 2)
+    out_x = [xs[0]]
+    out_y = [ys[0]]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+        # Point of the current bucket with the largest triangle
+        ax = xs[a]
+        ay = ys[a]
+        max_area = -1.0
+        chosen = a
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+        out_x.append(xs[chosen])
+        out_y.append(ys[chosen])
+        a = chosen
+    out_x.append(xs[n - 1])
+    out_y.append(ys[n - 1])
+    return out_x, out_y
@@ -0,0 +1,263 @@
+# loadtest.py
+# WebSocket load generator: opens many /ws connections to a local stats server and
+# reports what each viewer experiences and what it costs the server.
+#
+#   python loadtest.py --clients 1000 --duration 60
+#   python loadtest.py --clients 500 --mode delta --query "schema=2&limit=25"
+#   python loadtest.py --encoding msgpack --output results.json
+#
+# Per client it records frame inter-arrival jitter (deviation from the sample interval),
+# end-to-end latency (frame timestamp to receipt) and bytes received. The server's RSS
+# and CPU are sampled once a second through psutil. Only loopback targets are accepted.
+import argparse
+import asyncio
+import ipaddress
+import json
+import socket
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+import psutil
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+def require_loopback(url):
+    """Exit unless every address the URL's host resolves to is a loopback address."""
+    host = urlsplit(url).hostname
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror as e:
+        sys.exit(f"Cannot resolve {host}: {e}")
+    if not addresses or not all(ipaddress.ip_address(a.split('%')[0]).is_loopback for a in addresses):
+        sys.exit(f"Refusing to load-test {host}: only localhost targets are allowed")
+
+def find_server_pid(port):
+    """Return the pid of the process listening on port, or None if it can't be seen."""
+    try:
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.status == psutil.CONN_LISTEN and conn.laddr and conn.laddr.port == port and conn.pid:
+                return conn.pid
+    except psutil.AccessDenied:
+        pass
+    return None
+
+def raise_file_limit(needed):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+def decode_frame(message, encoding):
+    if encoding == 'msgpack':
+        return msgpack.unpackb(message, raw=False)
+    if encoding == 'cbor':
+        return cbor2.loads(message)
+    return json.loads(message)
+
+def frame_timestamp(frame):
+    """Sample timestamp of a full, keyframe or delta message, or None for other messages."""
+    if not isinstance(frame, dict):
+        return None
+    if frame.get('type') in ('keyframe', 'delta'):
+        return frame['data'].get('timestamp')
+    return frame.get('timestamp')
+
+def percentiles(values, *qs):
+    ordered = sorted(values)
+    if not ordered:
+        return {f'p{q}': None for q in qs}
+    return {f'p{q}': round(ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))], 3) for q in qs}
+
+class Client:
+    def __init__(self):
+        self.connected = False
+        self.error = None
+        self.frames = 0
+        self.bytes = 0
+        self.arrivals = []
+        self.latencies_ms = []
+
+async def run_client(client, url, encoding, stop_at, measure_from):
+    subprotocols = [f'stats.{encoding}'] if encoding != 'json' else None
+    try:
+        async with websockets.connect(url, subprotocols=subprotocols, max_size=None,
+                                      compression=None, open_timeout=30) as ws:
+            client.connected = True
+            while True:
+                remaining = stop_at - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    message = await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    return
+                received = time.time()
+                now = time.monotonic()
+                if now < measure_from:
+                    continue  # Still ramping up; only count the steady state
+                client.bytes += len(message)
+                timestamp = frame_timestamp(decode_frame(message, encoding))
+                if timestamp is None:
+                    continue  # e.g. a backfill message
+                client.frames += 1
+                client.arrivals.append(now)
+                client.latencies_ms.append((received - timestamp) * 1000)
+    except Exception as e:
+        client.error = f"{type(e).__name__}: {e}"
+
+async def sample_server(pid, measure_from, stop_at, samples):
+    try:
+        process = psutil.Process(pid)
+        children = {}
+        process.cpu_percent()
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(1)
+            # Include worker processes so multi-process servers add up
+            for child in process.children(recursive=True):
+                if child.pid not in children:
+                    children[child.pid] = child
+                    child.cpu_percent()
+            rss = process.memory_info().rss
+            cpu = process.cpu_percent()
+            for child_pid, child in list(children.items()):
+                try:
+                    rss += child.memory_info().rss
+                    cpu += child.cpu_percent()
+                except psutil.NoSuchProcess:
+                    del children[child_pid]
+            if time.monotonic() >= measure_from:
+                samples.append({'rss': rss, 'cpu_percent': cpu})
+    except psutil.Error:
+        pass
+
+def jitter_ms(arrivals, interval):
+    """Deviation of each inter-arrival gap from the sample interval, in milliseconds."""
+    return [abs((b - a) - interval) * 1000 for a, b in zip(arrivals, arrivals[1:])]
+
+def summarize(clients, server_samples, args, elapsed):
+    connected = [c for c in clients if c.connected]
+    errors = {}
+    for c in clients:
+        if c.error:
+            errors[c.error] = errors.get(c.error, 0) + 1
+    latencies = [v for c in connected for v in c.latencies_ms]
+    jitters = [v for c in connected for v in jitter_ms(c.arrivals, args.interval)]
+    frames = [c.frames for c in connected]
+    byte_counts = [c.bytes for c in connected]
+    summary = {
+        'target': args.url,
+        'clients': args.clients,
+        'connected': len(connected),
+        'failed': len(clients) - len(connected),
+        'errors': errors,
+        'measured_seconds': round(elapsed, 1),
+        'frames_per_client_per_second': round(statistics.fmean(frames) / elapsed, 3) if frames and elapsed else 0.0,
+        'bytes_per_client': round(statistics.fmean(byte_counts)) if byte_counts else 0,
+        'bytes_per_client_per_second': round(statistics.fmean(byte_counts) / elapsed) if byte_counts and elapsed else 0,
+        'latency_ms': {'mean': round(statistics.fmean(latencies), 3) if latencies else None,
+                       **percentiles(latencies, 50, 95, 99), 'max': round(max(latencies), 3) if latencies else None},
+        'jitter_ms': {**percentiles(jitters, 50, 95, 99), 'max': round(max(jitters), 3) if jitters else None},
+    }
+    if server_samples:
+        rss = [s['rss'] for s in server_samples]
+        cpu = [s['cpu_percent'] for s in server_samples]
+        summary['server'] = {
+            'pid': args.server_pid,
+            'rss_start': rss[0],
+            'rss_peak': max(rss),
+            'rss_end': rss[-1],
+            'cpu_percent_mean': round(statistics.fmean(cpu), 1),
+            'cpu_percent_max': round(max(cpu), 1),
+        }
+    return summary
+
+def print_summary(summary):
+    out = sys.stderr
+    print(f"target          {summary['target']}", file=out)
+    print(f"clients         {summary['connected']} connected, {summary['failed']} failed "
+          f"of {summary['clients']} over {summary['measured_seconds']} s", file=out)
+    for error, count in summary['errors'].items():
+        print(f"  {count} x {error}", file=out)
+    print(f"frames          {summary['frames_per_client_per_second']} per client per second", file=out)
+    print(f"bytes           {summary['bytes_per_client']} per client, "
+          f"{summary['bytes_per_client_per_second']} per client per second", file=out)
+    for key in ('latency_ms', 'jitter_ms'):
+        values = ', '.join(f"{k} {v}" for k, v in summary[key].items())
+        print(f"{key:<15} {values}", file=out)
+    server = summary.get('server')
+    if server:
+        print(f"server rss      start {server['rss_start'] >> 20} MiB, peak {server['rss_peak'] >> 20} MiB, "
+              f"end {server['rss_end'] >> 20} MiB", file=out)
+        print(f"server cpu      mean {server['cpu_percent_mean']}%, max {server['cpu_percent_max']}%", file=out)
+
+async def run(args):
+    url = args.url + ('&' if '?' in args.url else '?') + f"mode={args.mode}"
+    if args.query:
+        url += '&' + args.query
+    clients = [Client() for _ in range(args.clients)]
+    ramp_seconds = args.clients / args.ramp if args.ramp else 0
+    start = time.monotonic()
+    measure_from = start + ramp_seconds + args.warmup
+    stop_at = measure_from + args.duration
+    server_samples = []
+    tasks = []
+    if args.server_pid:
+        tasks.append(asyncio.create_task(sample_server(args.server_pid, measure_from, stop_at, server_samples)))
+    for i, client in enumerate(clients):
+        tasks.append(asyncio.create_task(run_client(client, url, args.encoding, stop_at, measure_from)))
+        if args.ramp and (i + 1) % args.ramp == 0:
+            await asyncio.sleep(1)
+    await asyncio.gather(*tasks)
+    # Rates are over the time actually measured: clients may all stop early, or the run overrun
+    elapsed = max(0.0, time.monotonic() - measure_from)
+    return summarize(clients, server_samples, args, elapsed)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Open many dashboard WebSocket clients against a local stats server.")
+    parser.add_argument('--url', default='ws://127.0.0.1:8003/ws')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=30, help="seconds measured after ramp-up and warm-up")
+    parser.add_argument('--ramp', type=int, default=200, help="new connections per second (0 opens all at once)")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds ignored after the last connection opens")
+    parser.add_argument('--mode', choices=('full', 'delta'), default='full')
+    parser.add_argument('--encoding', choices=('json', 'msgpack', 'cbor'), default='json')
+    parser.add_argument('--query', default='', help="extra query string, e.g. 'schema=2&limit=25'")
+    parser.add_argument('--interval', type=float, default=1.0, help="the server's sample interval in seconds")
+    parser.add_argument('--server-pid', type=int, help="server process to sample (found from the port if omitted)")
+    parser.add_argument('--output', help="write the summary as JSON to this file ('-' for stdout)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if websockets is None:
+        sys.exit("loadtest.py needs the websockets package")
+    if args.encoding == 'msgpack' and msgpack is None or args.encoding == 'cbor' and cbor2 is None:
+        sys.exit(f"--encoding {args.encoding} needs the {'msgpack' if args.encoding == 'msgpack' else 'cbor2'} package")
+    require_loopback(args.url)
+    if args.server_pid is None:
+        args.server_pid = find_server_pid(urlsplit(args.url).port or 80)
+    raise_file_limit(args.clients + 64)
+    summary = asyncio.run(run(args))
+    print_summary(summary)
+    if args.output == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
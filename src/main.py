@@ -1,12 +1,76 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Request, HTTPException
+from fastapi.responses import HTMLResponse, Response, PlainTextResponse
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
 import asyncio
+import hashlib
+import heapq
+from collections import Counter
 import psutil
+import json
+import logging
+import time
 from datetime import datetime
-import aiofiles
 import platform
 import socket
 import os
+import sys
+from array import array
+import procnet
+import history
+import archive
+import assets
+import snapshot
+import timings
+
+logger = logging.getLogger(__name__)
+
+# Optional binary WebSocket encodings, offered only when the library is installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# Start the shared sampler with the app and stop it on shutdown. With a snapshot path set,
+# the app is one of several workers: it follows the collector's snapshot file and reads
+# the collector's archive instead of writing its own.
+@asynccontextmanager
+async def lifespan(app):
+    load_assets()
+    loop = asyncio.get_running_loop()
+    if SNAPSHOT_PATH:
+        open_archive(readonly=True)
+        tasks = [
+            asyncio.create_task(seed_rollups_in_background()),
+            asyncio.create_task(snapshot_reader_loop()),
+            asyncio.create_task(monitor_loop_lag()),
+        ]
+    else:
+        await initialize_static_data()
+        open_archive()
+        tasks = [
+            asyncio.create_task(seed_rollups_in_background()),
+            asyncio.create_task(sampler_loop()),
+            asyncio.create_task(monitor_loop_lag()),
+            asyncio.create_task(archive_writer()),
+        ]
+    try:
+        yield
+    finally:
+        for task in tasks + list(collector_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metric_archive is not None:
+            await loop.run_in_executor(None, metric_archive.close)
+        collector_executor.shutdown(wait=False)
+        mount_executor.shutdown(wait=False, cancel_futures=True)
+        connections_executor.shutdown(wait=False, cancel_futures=True)
 
 app = FastAPI(
     title="Stats App",
@@ -23,12 +87,14 @@ app = FastAPI(
     },
     openapi_url="/openapi.json",
     docs_url="/docs",
-    redoc_url="/",
+    redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 
 # Cache for static data
 static_data = {}
+boot_time = psutil.boot_time()
 
 # Initialize static data that doesn't change frequently
 async def initialize_static_data():
@@ -36,46 +102,67 @@ async def initialize_static_data():
     static_data['kernel_version'] = platform.release()
     static_data['os_release'] = platform.platform()
     static_data['hostname'] = socket.gethostname()
-    static_data['cpu_frequency'] = get_cpu_frequency()
+    static_data['cpu_frequency_mhz'] = get_cpu_frequency()
     static_data['logged_in_users'] = len(psutil.users())
 
+# Services monitored with systemctl: unit name -> display name
+SERVICES = {
+    'lsws': 'LiteSpeed Web Server',
+    'mariadb': 'MySQL (MariaDB)',
+    'aiapi': 'AI Apps Service (FastAPI)',
+    'elasticsearch': 'Elasticsearch',
+    'fastapi': 'FastAPI for XenForo Universal Search'
+}
+
+# Result of the most recent systemctl probe, reused when a probe fails
+service_probe = {
+    'status': {},
+    'latency_ms': None,
+    'ok': False,
+}
+
 # Function to check service status using systemctl
 async def get_service_status():
-    services = {
-        'lsws': 'LiteSpeed Web Server',
-        'mariadb': 'MySQL (MariaDB)',
-        'aiapi': 'AI Apps Service (FastAPI)',
-        'elasticsearch': 'Elasticsearch',
-        'fastapi': 'FastAPI for XenForo Universal Search'
-    }
-    service_status = {}
-    tasks = []
-    for service_name, display_name in services.items():
-        tasks.append(check_service_status(service_name, display_name))
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    for result in results:
-        if isinstance(result, Exception):
-            continue  # Handle exceptions if necessary
-        display_name, status = result
-        service_status[display_name] = status
-    return service_status
-
-async def check_service_status(service_name, display_name):
-    try:
-        status = await run_command_output(f'systemctl is-active {service_name}')
-        return (display_name, status.strip() == 'active')
-    except Exception:
-        return (display_name, False)
+    """Query every configured unit with a single `systemctl show` call."""
+    units = list(SERVICES)
+    start = time.perf_counter()
+    output = await run_command_output(
+        'systemctl', 'show', '--property=ActiveState', '--', *units
+    )
+    service_probe['latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    states = parse_systemctl_show(output, units)
+    service_probe['ok'] = len(states) == len(units)
+    if service_probe['ok'] or not service_probe['status']:
+        service_probe['status'] = {
+            display_name: states.get(unit) == 'active'
+            for unit, display_name in SERVICES.items()
+        }
+    return service_probe['status']
+
+def parse_systemctl_show(output, units):
+    """Map each unit to its ActiveState; systemctl prints one block per unit, in order."""
+    states = {}
+    blocks = [block for block in output.strip().split('\n\n') if block.strip()]
+    for unit, block in zip(units, blocks):
+        for line in block.splitlines():
+            key, _, value = line.partition('=')
+            if key == 'ActiveState':
+                states[unit] = value.strip()
+    return states
 
-async def run_command_output(command):
+async def run_command_output(*args):
+    """Run a program without a shell and return its stdout, or '' on failure or timeout."""
     try:
-        process = await asyncio.create_subprocess_shell(
-            command,
+        process = await asyncio.create_subprocess_exec(
+            *args,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.DEVNULL
         )
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=5)
-        return stdout.decode() + stderr.decode()
+    except OSError:
+        return ''
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=5)
+        return stdout.decode()
     except asyncio.TimeoutError:
         process.kill()
         await process.communicate()
@@ -88,6 +175,8 @@ async def run_command_output(command):
 # Function to get network connections
 def format_bytes(bytes_value, unit='auto'):
     """Convert bytes to human readable format"""
+    if bytes_value is None:
+        return "N/A" if unit == 'auto' else None
     if unit == 'auto':
         for unit_name in ['B', 'KB', 'MB', 'GB', 'TB']:
             if bytes_value < 1024.0:
@@ -126,149 +215,1421 @@ def get_cpu_info():
     except Exception:
         return "N/A"
 
-# Function to get CPU frequency
+# Function to get CPU frequency in MHz, or None when unavailable
 def get_cpu_frequency():
     try:
         cpu_freq = psutil.cpu_freq()
-        return f"{cpu_freq.current:.2f} MHz" if cpu_freq else "N/A"
+        return cpu_freq.current if cpu_freq else None
     except Exception:
-        return "N/A"
+        return None
 
-# Function to collect stats
-async def collect_stats(previous_net_io):
+# Collectors: each one samples a single area of the host and returns the raw fields it owns.
+# Human-readable formatting for the original payload happens in format_v1().
+def collect_cpu():
+    return {
+        'cpu_utilization': psutil.cpu_percent(interval=0),
+        'per_cpu_utilization': psutil.cpu_percent(interval=0, percpu=True),
+    }
+
+def collect_memory():
+    memory = psutil.virtual_memory()
+    swap = psutil.swap_memory()
+    return {
+        'memory_utilization': memory.percent,
+        'memory_total': memory.total,
+        'memory_available': memory.available,
+        'memory_used': memory.used,
+        'swap_utilization': swap.percent,
+    }
+
+# Previous reading of each set of cumulative counters: name -> (monotonic time, counters)
+previous_counters = {}
+
+def counter_rates(name, counters, fields):
+    """Per-second rates of cumulative counters, over the time actually elapsed since the last reading."""
+    now = time.monotonic()
+    previous = previous_counters.get(name)
+    previous_counters[name] = (now, counters)
+    if previous is None or now <= previous[0]:
+        return [0.0] * len(fields)
+    elapsed = now - previous[0]
+    # Counters can go backwards when a device or interface is reset
+    return [round(max(0, getattr(counters, f) - getattr(previous[1], f)) / elapsed, 1) for f in fields]
+
+# Filesystems that hold no user data and are left out of the mount listing
+PSEUDO_FILESYSTEMS = {
+    'autofs', 'binfmt_misc', 'bpf', 'cgroup', 'cgroup2', 'configfs', 'debugfs', 'devpts',
+    'devtmpfs', 'efivarfs', 'fusectl', 'hugetlbfs', 'mqueue', 'nsfs', 'proc', 'pstore',
+    'ramfs', 'rpc_pipefs', 'securityfs', 'selinuxfs', 'squashfs', 'sysfs', 'tmpfs', 'tracefs',
+}
+# Block devices whose I/O isn't storage traffic
+IGNORED_DISK_PREFIXES = ('loop', 'ram', 'zram')
+# Seconds to wait for statvfs on all mounts together, capped at half the disk
+# collector's budget so the I/O counters still make it into the same frame
+MOUNT_TIMEOUT = 0.25
+
+# statvfs on a hung network mount never returns, so it runs in its own pool. A mount
+# whose previous call is still stuck is reported as hung instead of being asked again,
+# and once hung mounts hold every thread, the rest are skipped rather than queued.
+MOUNT_PROBE_THREADS = 4
+mount_executor = ThreadPoolExecutor(max_workers=MOUNT_PROBE_THREADS, thread_name_prefix='statvfs')
+pending_mounts = {}
+# Last root filesystem usage that was read, reported while / doesn't answer
+root_usage = {'percent': None}
+
+def collect_mounts():
+    futures = {}
+    submitted = []
+    hung = sum(1 for future in pending_mounts.values() if future.running())
+    for part in psutil.disk_partitions(all=True):
+        if part.fstype in PSEUDO_FILESYSTEMS or part.mountpoint in futures:
+            continue
+        future = pending_mounts.get(part.mountpoint)
+        previous = None
+        if future is not None and not future.done():
+            # Still stuck from an earlier tick, or queued behind mounts that are
+            if not future.running() and hung >= MOUNT_PROBE_THREADS and future.cancel():
+                future = None
+        elif hung >= MOUNT_PROBE_THREADS:
+            future = None
+        else:
+            # The last finished probe answers for this pass if the fresh one is slow,
+            # so a mount slower than the wait still reports its usage a pass late
+            previous = future if future is not None and not future.cancelled() else None
+            future = mount_executor.submit(psutil.disk_usage, part.mountpoint)
+            pending_mounts[part.mountpoint] = future
+            submitted.append(future)
+        futures[part.mountpoint] = (part, future, previous)
+    concurrent.futures.wait(submitted, timeout=min(MOUNT_TIMEOUT, COLLECTOR_BUDGETS['disk'] / 2))
+    mounts = []
+    for mountpoint, (part, future, previous) in futures.items():
+        row = {'mountpoint': mountpoint, 'device': part.device, 'fstype': part.fstype}
+        if previous is not None and not future.done():
+            future = previous
+        if future is None:
+            row['error'] = 'skipped'
+        elif not future.done():
+            row['error'] = 'timeout'
+        elif future.exception() is not None:
+            row['error'] = str(future.exception())
+        else:
+            usage = future.result()
+            row.update(total=usage.total, used=usage.used, free=usage.free, percent=usage.percent)
+        mounts.append(row)
+    for mountpoint in list(pending_mounts):
+        if mountpoint not in futures:
+            del pending_mounts[mountpoint]
+    return mounts
+
+def collect_disk_devices():
+    devices = []
+    # psutil returns None rather than raising when the kernel exposes no disk stats
+    for name, counters in sorted((psutil.disk_io_counters(perdisk=True) or {}).items()):
+        if name.startswith(IGNORED_DISK_PREFIXES):
+            continue
+        read_rate, write_rate, read_iops, write_iops = counter_rates(
+            'disk:' + name, counters, ('read_bytes', 'write_bytes', 'read_count', 'write_count'))
+        devices.append({
+            'name': name,
+            'read_rate': read_rate,  # bytes/s
+            'write_rate': write_rate,  # bytes/s
+            'read_iops': read_iops,
+            'write_iops': write_iops,
+        })
+    return devices
+
+def collect_disk():
+    mounts = collect_mounts()
+    root = next((m for m in mounts if m['mountpoint'] == '/' and 'percent' in m), None)
+    if root is not None:
+        root_usage['percent'] = root['percent']
+    disk_io = psutil.disk_io_counters()
+    if disk_io is not None:
+        read_rate, write_rate = counter_rates('disk', disk_io, ('read_bytes', 'write_bytes'))
+    else:
+        # No counters (e.g. some containers): only the I/O fields are unknown
+        read_rate = write_rate = None
+    return {
+        # Never statvfs / inline: a hung root would stall the collector thread
+        'disk_utilization': root_usage['percent'],
+        'disk_utilization_stale': root is None,
+        'disk_read_bytes': disk_io.read_bytes if disk_io is not None else None,
+        'disk_write_bytes': disk_io.write_bytes if disk_io is not None else None,
+        'disk_read_rate': read_rate,  # bytes/s
+        'disk_write_rate': write_rate,  # bytes/s
+        'disk_devices': collect_disk_devices(),
+        'disk_mounts': mounts,
+    }
+
+# Persistent process table: (pid, create_time) -> row. Rows are replaced rather than
+# mutated when their values change, so frames that were already published never change.
+process_table = {}
+
+def read_process_field(method):
     try:
-        # Get service statuses
-        service_status = await get_service_status()
-
-        # Get utilization data using psutil
-        cpu_utilization = psutil.cpu_percent(interval=0)
-        per_cpu_utilization = psutil.cpu_percent(interval=0, percpu=True)
-        memory = psutil.virtual_memory()
-        memory_utilization = memory.percent
-        memory_total_gb = format_bytes(memory.total, 'GB')
-        memory_available_gb = format_bytes(memory.available, 'GB')
-        memory_used_gb = format_bytes(memory.used, 'GB')
-        swap = psutil.swap_memory()
-        swap_utilization = swap.percent
-        disk = psutil.disk_usage('/')
-        disk_utilization = disk.percent
-
-        # Get uptime
-        uptime_seconds = int(datetime.now().timestamp() - psutil.boot_time())
-        uptime_hours = uptime_seconds // 3600
-        uptime_minutes = (uptime_seconds % 3600) // 60
-        uptime_seconds_remaining = uptime_seconds % 60
-        uptime_output = f"{uptime_hours}h {uptime_minutes}m {uptime_seconds_remaining}s"
-
-        # Get processes and sort by CPU utilization
-        processes = []
-        for p in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-            cpu_percent = p.info.get('cpu_percent', 0.0)
-            memory_percent = p.info.get('memory_percent', 0.0)
-            processes.append({
-                'pid': p.info['pid'],
-                'name': p.info['name'],
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory_percent
-            })
-        # Sort processes by CPU utilization descending
-        processes_sorted = sorted(processes, key=lambda x: x['cpu_percent'], reverse=True)
-
-        # Network info
-        net_io = psutil.net_io_counters()
-        sent_bytes = net_io.bytes_sent
-        recv_bytes = net_io.bytes_recv
-        if previous_net_io is not None:
-            sent_rate = sent_bytes - previous_net_io.bytes_sent  # bytes/s
-            recv_rate = recv_bytes - previous_net_io.bytes_recv  # bytes/s
+        return method()
+    except psutil.AccessDenied:
+        return None
+
+def collect_processes():
+    # Update the process table in place; sorting and top-N selection happen per client view
+    first_sample = not process_table
+    seen = set()
+    started = []
+    for p in psutil.process_iter():
+        try:
+            with p.oneshot():
+                key = (p.pid, p.create_time())
+                cpu_percent = read_process_field(p.cpu_percent)
+                memory_percent = read_process_field(p.memory_percent)
+                row = process_table.get(key)
+                if row is None:
+                    row = {
+                        'pid': p.pid,
+                        'name': read_process_field(p.name),
+                        'cpu_percent': cpu_percent,
+                        'memory_percent': memory_percent
+                    }
+                    process_table[key] = row
+                    started.append(row)
+                elif row['cpu_percent'] != cpu_percent or row['memory_percent'] != memory_percent:
+                    process_table[key] = dict(row, cpu_percent=cpu_percent, memory_percent=memory_percent)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            continue
+        seen.add(key)
+    exited = [process_table.pop(key) for key in list(process_table) if key not in seen]
+    return {
+        'process_list': list(process_table.values()),  # Send as list of dicts
+        'process_count': len(process_table),
+        # Processes started or exited since the previous process sample
+        'process_events': {
+            'started': [] if first_sample else [{'pid': row['pid'], 'name': row['name']} for row in started],
+            'exited': [{'pid': row['pid'], 'name': row['name']} for row in exited],
+        },
+    }
+
+# Process sort keys a client may request: name -> (key function, descending)
+PROCESS_SORT_KEYS = {
+    'cpu': (lambda p: p['cpu_percent'] or 0.0, True),
+    'mem': (lambda p: p['memory_percent'] or 0.0, True),
+    'pid': (lambda p: p['pid'], True),
+    'name': (lambda p: (p['name'] or '').lower(), False),
+}
+
+def select_processes(processes, sort='cpu', limit=0):
+    """Return processes ordered by sort, keeping only the top `limit` rows when limit > 0."""
+    key, descending = PROCESS_SORT_KEYS[sort]
+    if 0 < limit < len(processes):
+        # Partial selection is O(n log k) instead of sorting the whole table
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return select(limit, processes, key=key)
+    return sorted(processes, key=key, reverse=descending)
+
+def collect_network():
+    net_io = psutil.net_io_counters()
+    sent_bytes = net_io.bytes_sent
+    recv_bytes = net_io.bytes_recv
+    sent_rate, recv_rate = counter_rates('network', net_io, ('bytes_sent', 'bytes_recv'))
+    return {
+        'network_upload_rate': sent_rate,  # bytes/s
+        'network_download_rate': recv_rate,  # bytes/s
+        'network_bytes_sent': sent_bytes,
+        'network_bytes_recv': recv_bytes,
+    }
+
+# Rows of the connection listing included in each frame; the rest is served by /api/connections
+CONNECTIONS_PAGE_SIZE = 100
+# The listing leaves out UDP sockets, which have no state (NONE) and aren't shown by the page;
+# the established page feeds the v1 text view. The summary still counts everything.
+TCP_PROTOCOLS = ('tcp', 'tcp6')
+
+def collect_connections():
+    # Open and active network connections
+    if procnet.available():
+        # Linux fast path: aggregate /proc/net directly and decode only the first pages
+        summary = procnet.summarize()
+        network_connections = procnet.list_connections(
+            0, CONNECTIONS_PAGE_SIZE, count_total=False, protocols=TCP_PROTOCOLS)['connections']
+        established = procnet.list_connections(
+            0, CONNECTIONS_PAGE_SIZE, 'ESTABLISHED', count_total=False, protocols=TCP_PROTOCOLS)['connections']
+    else:
+        network_connections = get_network_connections()
+        summary = {
+            'total': len(network_connections),
+            'by_state': dict(Counter(conn['status'] for conn in network_connections)),
+        }
+        established = [conn for conn in network_connections if conn['status'] == 'ESTABLISHED']
+        established = established[:CONNECTIONS_PAGE_SIZE]
+        network_connections = [conn for conn in network_connections if conn['status'] != 'NONE']
+        network_connections = network_connections[:CONNECTIONS_PAGE_SIZE]
+    return {
+        'network_connections_list': network_connections,  # Send structured data
+        'network_connections_established': established,
+        'network_connections_summary': summary,
+    }
+
+async def collect_services():
+    return {
+        'service_status': await get_service_status(),
+        'service_probe_ms': service_probe['latency_ms'],
+    }
+
+def collect_load():
+    # Load average (for UNIX systems)
+    return {'load_avg': list(os.getloadavg()) if hasattr(os, 'getloadavg') else None}
+
+COLLECTORS = {
+    'cpu': collect_cpu,
+    'memory': collect_memory,
+    'processes': collect_processes,
+    'network': collect_network,
+    'connections': collect_connections,
+    'services': collect_services,
+    'disk': collect_disk,
+    'load': collect_load,
+}
+
+# Refresh interval in seconds for each collector; frames reuse the cached result in between.
+# Override with e.g. STATS_COLLECTOR_INTERVALS="services=30,connections=10"
+COLLECTOR_INTERVALS = {
+    'cpu': 1,
+    'memory': 1,
+    'processes': 1,
+    'network': 1,
+    'connections': 5,
+    'services': 15,
+    'disk': 10,
+    'load': 5,
+}
+
+# Longest a frame waits for each collector, in seconds, including its very first run.
+# A collector that overruns keeps running in the background while the frame goes out
+# with its last good value, or with its placeholder fields if it never delivered one.
+# Override with e.g. STATS_COLLECTOR_BUDGETS="processes=0.9,disk=0.3"
+COLLECTOR_BUDGETS = {
+    'cpu': 0.5,
+    'memory': 0.5,
+    'processes': 0.8,
+    'network': 0.5,
+    'connections': 0.8,
+    'services': 0.5,
+    'disk': 0.5,
+    'load': 0.5,
+}
+
+# Fields a collector contributes until its first good result: unknown values are None
+# and listings are empty, so a collector that hangs or fails from the start leaves gaps
+# in the frame instead of holding the whole frame back.
+COLLECTOR_PLACEHOLDERS = {
+    'cpu': {'cpu_utilization': None, 'per_cpu_utilization': []},
+    'memory': {'memory_utilization': None, 'memory_total': None, 'memory_available': None,
+               'memory_used': None, 'swap_utilization': None},
+    'processes': {'process_list': [], 'process_count': None, 'process_events': {'started': [], 'exited': []}},
+    'network': {'network_upload_rate': None, 'network_download_rate': None,
+                'network_bytes_sent': None, 'network_bytes_recv': None},
+    'connections': {'network_connections_list': [], 'network_connections_established': [],
+                    'network_connections_summary': {'total': None, 'by_state': {}}},
+    'services': {'service_status': {}, 'service_probe_ms': None},
+    'disk': {'disk_utilization': None, 'disk_utilization_stale': True, 'disk_read_bytes': None,
+             'disk_write_bytes': None, 'disk_read_rate': None, 'disk_write_rate': None,
+             'disk_devices': [], 'disk_mounts': []},
+    'load': {'load_avg': []},
+}
+
+def load_collector_settings(variable, settings):
+    for item in os.environ.get(variable, '').split(','):
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name in settings:
+            try:
+                settings[name] = float(value)
+            except ValueError:
+                pass
+
+load_collector_settings('STATS_COLLECTOR_INTERVALS', COLLECTOR_INTERVALS)
+load_collector_settings('STATS_COLLECTOR_BUDGETS', COLLECTOR_BUDGETS)
+
+# Most recent good result of each collector:
+# name -> (monotonic time the run started, wall-clock time it started, fields)
+collector_cache = {}
+# Run in progress for each collector; a collector is never started again while one is
+collector_tasks = {}
+# Overruns and failures per collector since startup
+collector_counters = {name: {'timeouts': 0, 'errors': 0, 'last_error': None} for name in COLLECTORS}
+
+# Rolling timings for /debug/collectors of each collector and sampler step
+collector_timings = timings.SectionTimings()
+
+# How many items a collector's result covers, for per-item costs
+COLLECTOR_ITEMS = {
+    'cpu': lambda result: len(result['per_cpu_utilization']),
+    'processes': lambda result: len(result['process_list']),
+    'connections': lambda result: result['network_connections_summary']['total'],
+    'services': lambda result: len(result['service_status']),
+    'disk': lambda result: len(result['disk_devices']) + len(result['disk_mounts']),
+}
+
+def count_items(name, result):
+    count = COLLECTOR_ITEMS.get(name)
+    return count(result) if count else None
+
+def timed_call(name, func):
+    """Run a blocking collector, timed in its own thread so the CPU time is its own."""
+    with collector_timings.timed(name) as timing:
+        result = func()
+        timing['items'] = count_items(name, result)
+    return result
+
+# Blocking psutil collectors run here so they never stall the event loop
+collector_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('STATS_COLLECTOR_THREADS', 4)),
+    thread_name_prefix='collector',
+)
+
+async def run_collector(name, started, started_at):
+    func = COLLECTORS[name]
+    try:
+        if asyncio.iscoroutinefunction(func):
+            # Mostly waiting on a subprocess, so only wall time is meaningful
+            with collector_timings.timed(name, cpu=False) as timing:
+                result = await func()
+                timing['items'] = count_items(name, result)
         else:
-            sent_rate = 0
-            recv_rate = 0
-        # Format network rates with appropriate units
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(collector_executor, timed_call, name, func)
+    except Exception as e:
+        collector_counters[name]['errors'] += 1
+        collector_counters[name]['last_error'] = f"{type(e).__name__}: {e}"
+        return
+    collector_cache[name] = (started, started_at, result)
+
+async def wait_for_collector(name):
+    """Wait for a collector's run within its budget."""
+    task = collector_tasks[name]
+    done, _ = await asyncio.wait({task}, timeout=COLLECTOR_BUDGETS[name])
+    if not done:
+        collector_counters[name]['timeouts'] += 1
+
+# Event loop responsiveness: how late a periodic wakeup fires, in milliseconds
+LOOP_LAG_INTERVAL = 0.25  # seconds
+loop_lag = {'last_ms': 0.0, 'max_ms': 0.0}
+
+async def monitor_loop_lag():
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag_ms = max(0.0, (time.perf_counter() - start - LOOP_LAG_INTERVAL) * 1000)
+        loop_lag['last_ms'] = lag_ms
+        loop_lag['max_ms'] = max(loop_lag['max_ms'], lag_ms)
+
+def take_loop_lag():
+    """Return the worst loop lag seen since the previous call and reset it."""
+    worst = loop_lag['max_ms']
+    loop_lag['max_ms'] = loop_lag['last_ms']
+    return round(worst, 2)
+
+# Function to collect stats
+async def collect_stats():
+    # The sample is timestamped when its collection starts
+    timestamp = time.time()
+    # Refresh only the collectors whose interval has elapsed, concurrently
+    now = time.monotonic()
+    due = [
+        name for name in COLLECTORS
+        # Half a tick of slack, so scheduling jitter never pushes a refresh to the next tick
+        if name not in collector_cache
+        or now - collector_cache[name][0] >= COLLECTOR_INTERVALS[name] - SAMPLE_INTERVAL / 2
+    ]
+    for name in due:
+        if name not in collector_tasks or collector_tasks[name].done():
+            collector_tasks[name] = asyncio.create_task(run_collector(name, now, timestamp))
+    await asyncio.gather(*(wait_for_collector(name) for name in due))
+
+    # Build the frame from each collector's most recent good result. A collector that
+    # was due but didn't deliver this tick is marked stale; one that never delivered
+    # contributes its placeholders and is marked missing. The status carries the wall
+    # clock time its value was sampled rather than its age, so it only changes when the
+    # value does and delta frames stay small; clients subtract it from 'timestamp'.
+    stats = {
+        'timestamp': timestamp,
+        'uptime_seconds': int(timestamp - boot_time),
+        'event_loop_lag_ms': take_loop_lag(),
+        'missed_ticks': sampler_ticks['missed'],
+        'collector_status': {},
+    }
+    for name in COLLECTORS:
+        if name not in collector_cache:
+            stats.update(COLLECTOR_PLACEHOLDERS[name])
+            stats['collector_status'][name] = {
+                'updated_at': None,
+                'stale': True,
+                'missing': True,
+                'timeouts': collector_counters[name]['timeouts'],
+                'errors': collector_counters[name]['errors'],
+                'last_error': collector_counters[name]['last_error'],
+            }
+            continue
+        updated, updated_at, result = collector_cache[name]
+        stats.update(result)
+        stats['collector_status'][name] = {
+            'updated_at': updated_at,
+            'stale': name in due and updated != now,
+            'missing': False,
+            'timeouts': collector_counters[name]['timeouts'],
+            'errors': collector_counters[name]['errors'],
+            'last_error': collector_counters[name]['last_error'],
+        }
+
+    # Combine static data and dynamic stats
+    stats.update(static_data)
+
+    return stats
+
+# Raw fields that the original payload replaces with formatted strings
+V1_RAW_FIELDS = ('uptime_seconds', 'memory_total', 'memory_available', 'memory_used',
+                 'network_upload_rate', 'network_download_rate', 'network_bytes_sent',
+                 'network_bytes_recv', 'disk_read_bytes', 'disk_write_bytes', 'cpu_frequency_mhz',
+                 'network_connections_established')
+
+# Original payload schema (v1): pre-formatted strings next to the raw numbers
+def format_v1(stats):
+    data = {k: v for k, v in stats.items() if k not in V1_RAW_FIELDS}
+    # Get uptime
+    uptime_seconds = stats['uptime_seconds']
+    uptime_hours = uptime_seconds // 3600
+    uptime_minutes = (uptime_seconds % 3600) // 60
+    uptime_seconds_remaining = uptime_seconds % 60
+    data['uptime_output'] = f"{uptime_hours}h {uptime_minutes}m {uptime_seconds_remaining}s"
+    data['current_time'] = datetime.fromtimestamp(stats['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
+
+    # v1 pages format these without checking for null, so a collector that hasn't
+    # delivered yet shows up as 0.00 GB and "N/A" here; v2 keeps the None placeholders
+    for field in ('memory_total', 'memory_available', 'memory_used'):
+        data[field + '_gb'] = format_bytes(stats[field] or 0, 'GB')
+    for field in ('cpu_utilization', 'memory_utilization', 'swap_utilization', 'disk_utilization'):
+        if stats[field] is None:
+            data[field] = "N/A"
+
+    # Format network rates with appropriate units
+    sent_rate = stats['network_upload_rate']
+    recv_rate = stats['network_download_rate']
+    if sent_rate is None or recv_rate is None:
+        data['network_info'] = "N/A"
+        data['network_utilization'] = {'upload': 0, 'download': 0}
+    else:
         sent_rate_formatted = format_bytes(sent_rate, 'auto').replace(' ', ' ') + '/s'
         recv_rate_formatted = format_bytes(recv_rate, 'auto').replace(' ', ' ') + '/s'
-        network_info = f"Upload: {sent_rate_formatted}, Download: {recv_rate_formatted}"
+        data['network_info'] = f"Upload: {sent_rate_formatted}, Download: {recv_rate_formatted}"
         # Keep raw KB/s for charts
-        network_utilization = {'upload': sent_rate / 1024, 'download': recv_rate / 1024}
+        data['network_utilization'] = {'upload': sent_rate / 1024, 'download': recv_rate / 1024}
 
-        # Open and active network connections
-        network_connections = get_network_connections()
-        # Format network connections
-        connections_str = "\n".join([
-            f"Proto: {conn['type']}, Local Address: {conn['laddr']}, Remote Address: {conn['raddr']}, Status: {conn['status']}"
-            for conn in network_connections if conn['status'] == 'ESTABLISHED'
-        ])
-
-        # Disk I/O stats
-        disk_io = psutil.disk_io_counters()
-        disk_read = format_bytes(disk_io.read_bytes, 'auto')
-        disk_write = format_bytes(disk_io.write_bytes, 'auto')
-
-        # Load average (for UNIX systems)
-        if hasattr(os, 'getloadavg'):
-            load_avg = os.getloadavg()
-            load_avg_str = f"1 min: {load_avg[0]:.2f}, 5 min: {load_avg[1]:.2f}, 15 min: {load_avg[2]:.2f}"
-        else:
-            load_avg_str = "N/A"
-
-        # Current time
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # Package all stats into a dictionary
-        stats = {
-            'cpu_utilization': cpu_utilization,
-            'per_cpu_utilization': per_cpu_utilization,
-            'memory_utilization': memory_utilization,
-            'memory_total_gb': memory_total_gb,
-            'memory_available_gb': memory_available_gb,
-            'memory_used_gb': memory_used_gb,
-            'swap_utilization': swap_utilization,
-            'disk_utilization': disk_utilization,
-            'network_utilization': network_utilization,
-            'service_status': service_status,
-            'current_time': current_time,
-            'uptime_output': uptime_output,
-            'process_list': processes_sorted,  # Send as list of dicts
-            'network_info': network_info,
-            'network_connections': connections_str,
-            'network_connections_list': network_connections,  # Send structured data
-            'disk_read': disk_read,
-            'disk_write': disk_write,
-            'load_avg': load_avg_str,
-            'current_net_io': net_io  # Include for next iteration
-        }
+    # Format network connections
+    data['network_connections'] = "\n".join([
+        f"Proto: {conn['type']}, Local Address: {conn['laddr']}, Remote Address: {conn['raddr']}, Status: {conn['status']}"
+        for conn in stats['network_connections_established']
+    ])
+
+    data['disk_read'] = format_bytes(stats['disk_read_bytes'], 'auto')
+    data['disk_write'] = format_bytes(stats['disk_write_bytes'], 'auto')
+
+    load_avg = stats['load_avg']
+    if load_avg:
+        data['load_avg'] = f"1 min: {load_avg[0]:.2f}, 5 min: {load_avg[1]:.2f}, 15 min: {load_avg[2]:.2f}"
+    else:
+        data['load_avg'] = "N/A"
+
+    cpu_frequency = stats.get('cpu_frequency_mhz')
+    data['cpu_frequency'] = f"{cpu_frequency:.2f} MHz" if cpu_frequency else "N/A"
+    return data
 
-        # Combine static data and dynamic stats
-        stats.update(static_data)
+# Panels a client can subscribe to with ?fields=; names from both schemas are listed
+# so the same panel works for v1 and v2. Individual field names are accepted too.
+PANELS = {
+    'system': ['hostname', 'os_release', 'kernel_version', 'logged_in_users',
+               'uptime_seconds', 'uptime_output', 'event_loop_lag_ms', 'missed_ticks',
+               'collector_status'],
+    'cpu': ['cpu_utilization', 'per_cpu_utilization', 'cpu_info', 'cpu_frequency',
+            'cpu_frequency_mhz', 'load_avg'],
+    'memory': ['memory_utilization', 'memory_total', 'memory_available', 'memory_used',
+               'memory_total_gb', 'memory_available_gb', 'memory_used_gb', 'swap_utilization'],
+    'disk': ['disk_utilization', 'disk_utilization_stale', 'disk_read_bytes', 'disk_write_bytes',
+             'disk_read', 'disk_write', 'disk_read_rate', 'disk_write_rate', 'disk_devices', 'disk_mounts'],
+    'network': ['network_upload_rate', 'network_download_rate', 'network_bytes_sent',
+                'network_bytes_recv', 'network_info', 'network_utilization'],
+    'connections': ['network_connections_list', 'network_connections_established',
+                    'network_connections_summary', 'network_connections'],
+    'processes': ['process_list', 'process_count', 'process_events'],
+    'services': ['service_status', 'service_probe_ms'],
+}
 
-        return stats
+# Fields sent regardless of the subscription
+ALWAYS_FIELDS = {'timestamp', 'current_time'}
+
+def resolve_fields(spec, always=ALWAYS_FIELDS):
+    """Turn a comma separated string or list of panels/fields into a set, or None for everything."""
+    if not spec:
+        return None
+    names = spec.split(',') if isinstance(spec, str) else spec
+    fields = set(always)
+    for name in names:
+        name = str(name).strip()
+        fields.update(PANELS.get(name, [name]))
+    return frozenset(fields)
+
+def build_payload(stats, view):
+    """Build the payload for one client view from the raw stats."""
+    sort, limit, schema, fields = view
+    data = format_v1(stats) if schema == 1 else stats
+    if fields is not None:
+        data = {k: v for k, v in data.items() if k in fields}
+    elif data is stats:
+        data = dict(stats)
+    if 'process_list' in data:
+        data['process_list'] = select_processes(stats['process_list'], sort, limit)
+    return data
+
+# Shared sampler state: one collection per tick, fanned out to every client
+SAMPLE_INTERVAL = 1  # seconds
+KEYFRAME_INTERVAL = 30  # seconds between forced keyframes for delta clients
+SEND_TIMEOUT = 10  # seconds a single send may take before the client is dropped
+sampler_ticks = {'count': 0, 'missed': 0}
+latest_frame = None
+stats_condition = asyncio.Condition()
+
+def encode_json(data):
+    # Same compact encoding as WebSocket.send_json, done once per frame
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+# WebSocket subprotocols a client may request, mapped to the frame encoding used
+SUBPROTOCOLS = {'stats.json': 'json'}
+if msgpack is not None:
+    SUBPROTOCOLS['stats.msgpack'] = 'msgpack'
+if cbor2 is not None:
+    SUBPROTOCOLS['stats.cbor'] = 'cbor'
+
+# Numeric arrays sent as little-endian float32 typed arrays in binary encodings,
+# tagged 85 as in RFC 8746 (the same number is used as the msgpack ext type)
+TYPED_ARRAY_FIELDS = ('per_cpu_utilization', 'load_avg')
+FLOAT32_LE_TAG = 85
+
+def float32_bytes(values):
+    packed = array('f', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def pack_typed_arrays(data, encoding):
+    """Replace numeric array fields with tagged float32 byte strings."""
+    packed = dict(data)
+    for key in TYPED_ARRAY_FIELDS:
+        if isinstance(packed.get(key), list):
+            raw = float32_bytes(packed[key])
+            if encoding == 'msgpack':
+                packed[key] = msgpack.ExtType(FLOAT32_LE_TAG, raw)
+            else:
+                packed[key] = cbor2.CBORTag(FLOAT32_LE_TAG, raw)
+    return packed
+
+def encode_message(message, encoding):
+    """Encode a frame message as JSON text or msgpack/CBOR bytes."""
+    if encoding == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True)
+    if encoding == 'cbor':
+        return cbor2.dumps(message)
+    return encode_json(message)
+
+def negotiate_subprotocol(websocket):
+    """Pick the first subprotocol offered by the client that the server supports."""
+    for name in websocket.scope.get('subprotocols', []):
+        if name in SUBPROTOCOLS:
+            return name
+    return None
+
+# A client view selects what each client receives:
+# (process sort key, process limit, payload schema, subscribed fields or None for all)
+DEFAULT_VIEW = ('cpu', 0, 1, None)
+
+def client_view(client):
+    return (client['sort'], client['limit'], client['schema'], client['fields'])
+
+def parse_client_options(options, client):
+    """Update a client's view from query params or a subscription message."""
+    sort = options.get('sort', client['sort'])
+    client['sort'] = sort if sort in PROCESS_SORT_KEYS else 'cpu'
+    try:
+        client['limit'] = max(0, int(options.get('limit', client['limit'])))
+    except (TypeError, ValueError):
+        client['limit'] = 0
+    client['schema'] = 2 if str(options.get('schema', client['schema'])) == '2' else 1
+    if 'fields' in options:
+        client['fields'] = resolve_fields(options['fields'])
+
+class Frame:
+    """A published snapshot whose per-view payloads and encodings are built once and shared."""
+
+    def __init__(self, seq, stats, previous=None):
+        self.seq = seq
+        self.stats = stats
+        self.previous = previous
+        self.base_seq = previous.seq if previous else None
+        if previous is not None:
+            previous.previous = None  # Deltas only ever need one frame of history
+        self._payloads = {}
+        self._messages = {}
+        self._encoded = {}
+        self._etags = {}
+
+    def payload(self, view):
+        if view not in self._payloads:
+            self._payloads[view] = build_payload(self.stats, view)
+        return self._payloads[view]
+
+    def message(self, kind, view):
+        """Return the 'full', 'keyframe' or 'delta' message of this frame for a view."""
+        if (kind, view) not in self._messages:
+            data = self.payload(view)
+            if kind == 'full':
+                message = data
+            elif kind == 'keyframe':
+                message = {'type': 'keyframe', 'seq': self.seq, 'data': data}
+            else:
+                previous = self.previous.payload(view)
+                message = {
+                    'type': 'delta',
+                    'seq': self.seq,
+                    'base': self.base_seq,
+                    'data': {k: v for k, v in data.items() if k not in previous or previous[k] != v},
+                    'removed': [k for k in previous if k not in data],
+                }
+            self._messages[kind, view] = message
+        return self._messages[kind, view]
+
+    def encode(self, kind, view=DEFAULT_VIEW, encoding='json'):
+        """Return the encoded message, built once per tick and reused for every subscriber."""
+        if kind == 'delta' and self.previous is None:
+            kind = 'keyframe'
+        key = (kind, view, encoding)
+        if key not in self._encoded:
+            message = self.message(kind, view)
+            if encoding != 'json':
+                if kind == 'full':
+                    message = pack_typed_arrays(message, encoding)
+                else:
+                    message = dict(message, data=pack_typed_arrays(message['data'], encoding))
+            self._encoded[key] = encode_message(message, encoding)
+        return self._encoded[key]
+
+    def etag(self, view):
+        """Strong ETag of the full JSON encoding for a view: a hash of the body itself."""
+        if view not in self._etags:
+            body = self.encode('full', view).encode()
+            self._etags[view] = '"' + hashlib.sha1(body).hexdigest() + '"'
+        return self._etags[view]
+
+async def publish_stats(stats):
+    global latest_frame
+    async with stats_condition:
+        seq = latest_frame.seq + 1 if latest_frame else 1
+        latest_frame = Frame(seq, stats, latest_frame)
+        stats_condition.notify_all()
+
+async def wait_for_frame(last_seq):
+    """Wait until a frame newer than last_seq is published and return it."""
+    async with stats_condition:
+        await stats_condition.wait_for(lambda: latest_frame is not None and latest_frame.seq != last_seq)
+        return latest_frame
+
+# Recent history of the main numeric metrics, used to backfill new clients.
+# Network rates are in bytes/s; per-CPU series are named cpu0, cpu1, ...
+HISTORY_SECONDS = 15 * 60
+CPU_COUNT = psutil.cpu_count() or 1
+HISTORY_METRICS = ['cpu', 'memory', 'swap', 'disk', 'net_up', 'net_down'] + [f'cpu{i}' for i in range(CPU_COUNT)]
+metric_history = history.MetricHistory(HISTORY_METRICS, int(HISTORY_SECONDS / SAMPLE_INTERVAL))
+
+# Downsampled tiers of the aggregate metrics: (bucket seconds, buckets kept).
+# 10 s for an hour, 1 min for a day and 1 h for a week.
+ROLLUP_METRICS = HISTORY_METRICS[:6]
+ROLLUP_TIERS = [(10, 360), (60, 1440), (3600, 168)]
+metric_rollups = history.Rollups(ROLLUP_METRICS, ROLLUP_TIERS)
+
+def record_history(stats):
+    per_cpu = stats['per_cpu_utilization'][:CPU_COUNT]
+    values = [
+        stats['cpu_utilization'],
+        stats['memory_utilization'],
+        stats['swap_utilization'],
+        stats['disk_utilization'],
+        stats['network_upload_rate'],
+        stats['network_download_rate'],
+        *per_cpu,
+        *[0.0] * (CPU_COUNT - len(per_cpu)),
+    ]
+    # The series are fixed-width float columns, so a collector that hasn't delivered yet
+    # records 0; collector_status in the frame says which values are placeholders
+    values = [0.0 if value is None else value for value in values]
+    metric_history.record(stats['timestamp'], values)
+    metric_rollups.add(stats['timestamp'], values[:len(ROLLUP_METRICS)])
+    if rollups_seeding['pending'] is not None:
+        rollups_seeding['pending'].append((stats['timestamp'], values[:len(ROLLUP_METRICS)]))
+    if metric_archive is not None and not metric_archive.readonly:
+        metric_archive.append(stats['timestamp'], values[:len(ROLLUP_METRICS)])
+
+# On-disk archive of the aggregate metrics so history survives restarts.
+# Set STATS_ARCHIVE_DIR to an empty string to disable it.
+ARCHIVE_DIR = os.environ.get('STATS_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_FLUSH_INTERVAL = 10  # seconds between batched writes
+ARCHIVE_RETENTION = 7 * 86400  # seconds
+metric_archive = None
+# Samples recorded while the rollups are being rebuilt from the archive, replayed on top
+rollups_seeding = {'pending': None}
+
+def open_archive(readonly=False):
+    global metric_archive
+    if not ARCHIVE_DIR:
+        return
+    try:
+        metric_archive = archive.Archive(ARCHIVE_DIR, ROLLUP_METRICS, SAMPLE_INTERVAL,
+                                         retention_seconds=ARCHIVE_RETENTION, readonly=readonly)
+    except (OSError, ValueError):
+        metric_archive = None
+
+def seed_rollups(until):
+    """Rebuild the rollup tiers from the archive up to until, so they don't start empty on every restart."""
+    rollups = history.Rollups(ROLLUP_METRICS, ROLLUP_TIERS)
+    span = max(resolution * capacity for resolution, capacity in ROLLUP_TIERS)
+    for timestamps, columns in metric_archive.read(until - span, until):
+        series = [columns[name] for name in ROLLUP_METRICS]
+        for row, timestamp in enumerate(timestamps):
+            rollups.add(timestamp, [values[row] for values in series])
+    return rollups
+
+# A week of archive takes seconds to read, so the rollups are rebuilt in a thread after
+# startup. Tiers only take samples in time order, so the rebuild goes into a new Rollups
+# while the live one keeps serving; samples recorded meanwhile are replayed on top of
+# it and it replaces the live one, all on the event loop.
+async def seed_rollups_in_background():
+    global metric_rollups
+    if metric_archive is None:
+        return
+    loop = asyncio.get_running_loop()
+    until = time.time()
+    rollups_seeding['pending'] = []
+    try:
+        rollups = await loop.run_in_executor(None, seed_rollups, until)
     except Exception:
-        return {}
+        logger.exception("Rollups not rebuilt from the archive")
+        return
+    finally:
+        pending, rollups_seeding['pending'] = rollups_seeding['pending'], None
+    for timestamp, values in pending:
+        if timestamp > until:
+            rollups.add(timestamp, values)
+    metric_rollups = rollups
+
+# Write queued archive samples from a worker thread so the sampler never waits on fsync.
+# A failed flush is logged and retried on the next round; the task itself never exits.
+async def archive_writer():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(ARCHIVE_FLUSH_INTERVAL)
+        if metric_archive is not None:
+            try:
+                await loop.run_in_executor(None, metric_archive.flush)
+            except Exception:
+                logger.exception("Archive flush failed")
+
+# Background task that samples the host once per tick for all subscribers.
+# Ticks are scheduled on the loop's monotonic clock, so collection time doesn't stretch
+# the period. A collection that overruns skips the ticks it covered and counts them.
+# In the collector process each sample goes to the snapshot writer instead of local clients,
+# together with the collector's /debug/collectors report.
+async def sampler_loop(writer=None):
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        with collector_timings.timed('sampler.collect', cpu=False):
+            stats = await collect_stats()
+        with collector_timings.timed('sampler.publish'):
+            if writer is None:
+                await publish_stats(stats)
+            else:
+                try:
+                    writer.write({'stats': stats, 'debug': collector_report()})
+                    snapshot_error['last'] = None
+                except (snapshot.SnapshotTooLarge, OSError) as e:
+                    # Logged when a failure starts or changes kind, not on every tick
+                    if type(e) is not snapshot_error['last']:
+                        logger.error("Snapshot not written: %s", e)
+                    snapshot_error['last'] = type(e)
+            record_history(stats)
+        sampler_ticks['count'] += 1
+        next_tick += SAMPLE_INTERVAL
+        now = loop.time()
+        if now >= next_tick:
+            missed = int((now - next_tick) // SAMPLE_INTERVAL) + 1
+            sampler_ticks['missed'] += missed
+            next_tick += missed * SAMPLE_INTERVAL
+        await asyncio.sleep(next_tick - now)
+
+# Multi-worker mode: one collector process samples the host and writes every snapshot to
+# a shared-memory file (see snapshot.py); each uvicorn worker maps the file, decodes new
+# snapshots straight out of the mapping and serves its own clients from them.
+#   STATS_WORKERS=4 python main.py
+# or, with the processes managed separately:
+#   python main.py collector
+#   STATS_SNAPSHOT=/dev/shm/stats-snapshot uvicorn main:app --port 8003 --workers 4
+# Set STATS_SNAPSHOT for both the collector and the workers; empty means single-process.
+# Workers read the collector's archive (STATS_ARCHIVE_DIR) read-only for long-range history.
+DEFAULT_SNAPSHOT_PATH = '/dev/shm/stats-snapshot'
+WORKERS = int(os.environ.get('STATS_WORKERS', 1))
+SNAPSHOT_PATH = os.environ.get('STATS_SNAPSHOT', DEFAULT_SNAPSHOT_PATH if WORKERS > 1 else '')
+SNAPSHOT_POLL_INTERVAL = 0.02  # seconds between checks for a new snapshot
+SNAPSHOT_REOPEN_AFTER = 5  # seconds without a new snapshot before checking for a new file
+snapshot_error = {'last': None}
+# The collector's /debug/collectors report from the newest snapshot, served by workers
+collector_debug = {'report': None}
+
+# The collector process: sampler, archive and loop-lag monitor, no web server
+async def collector_main():
+    await initialize_static_data()
+    open_archive()
+    writer = snapshot.SnapshotWriter(SNAPSHOT_PATH or DEFAULT_SNAPSHOT_PATH)
+    tasks = [
+        asyncio.create_task(monitor_loop_lag()),
+        asyncio.create_task(archive_writer()),
+    ]
+    try:
+        await sampler_loop(writer)
+    finally:
+        for task in tasks + list(collector_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metric_archive is not None:
+            metric_archive.close()
+        writer.close()
+        collector_executor.shutdown(wait=False)
+        mount_executor.shutdown(wait=False, cancel_futures=True)
+
+def run_collector_process():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    try:
+        asyncio.run(collector_main())
+    except KeyboardInterrupt:
+        pass
+
+def open_snapshot_reader():
+    try:
+        return snapshot.SnapshotReader(SNAPSHOT_PATH)
+    except (OSError, ValueError):
+        return None
+
+# Worker side: publish each new snapshot from the collector to this worker's clients.
+# A restarted collector creates a new file, so a long silence triggers a reopen.
+async def snapshot_reader_loop():
+    reader = None
+    generation = 0
+    last_change = time.monotonic()
+    try:
+        while True:
+            if reader is None:
+                reader = open_snapshot_reader()
+                generation = 0
+                last_change = time.monotonic()
+                if reader is None:
+                    await asyncio.sleep(SAMPLE_INTERVAL)
+                    continue
+            result = reader.read(generation)
+            if result is not None:
+                generation, payload = result
+                stats = payload['stats']
+                collector_debug['report'] = payload['debug']
+                last_change = time.monotonic()
+                await publish_stats(stats)
+                record_history(stats)
+            elif time.monotonic() - last_change > SNAPSHOT_REOPEN_AFTER and reader.replaced():
+                reader.close()
+                reader = None
+                continue
+            await asyncio.sleep(SNAPSHOT_POLL_INTERVAL)
+    finally:
+        if reader is not None:
+            reader.close()
+
+def decode_client_message(received, encoding):
+    if received.get('bytes') is not None:
+        if encoding == 'msgpack':
+            return msgpack.unpackb(received['bytes'], raw=False)
+        if encoding == 'cbor':
+            return cbor2.loads(received['bytes'])
+        return json.loads(received['bytes'])
+    return json.loads(received.get('text') or 'null')
+
+# Handle control messages sent by a client, e.g. {"action": "keyframe"},
+# {"action": "processes", "sort": "mem", "limit": 20} or
+# {"action": "subscribe", "schema": 2, "fields": ["cpu", "memory"]}.
+# Messages may be JSON text or use the negotiated binary encoding.
+async def receive_client_messages(websocket, client):
+    while True:
+        received = await websocket.receive()
+        if received['type'] == 'websocket.disconnect':
+            return
+        try:
+            message = decode_client_message(received, client['encoding'])
+        except Exception:
+            continue
+        if not isinstance(message, dict):
+            continue
+        action = message.get('action')
+        if action == 'keyframe':
+            client['keyframe_requested'] = True
+        elif action in ('processes', 'subscribe'):
+            parse_client_options(message, client)
+            client['keyframe_requested'] = True
+
+# Connected WebSocket clients and their delivery counters, by connection id
+ws_clients = {}
+next_client_id = 0
+
+def new_client_counters():
+    return {
+        'frames_sent': 0,
+        'frames_dropped': 0,
+        'bytes_sent': 0,
+        'send_ms_last': 0.0,
+        'send_ms_max': 0.0,
+        'send_ms_total': 0.0,
+    }
+
+async def send_data(websocket, client, data):
+    """Send one encoded message, giving up after SEND_TIMEOUT, and record how long it took."""
+    started = time.perf_counter()
+    if isinstance(data, bytes):
+        await asyncio.wait_for(websocket.send_bytes(data), SEND_TIMEOUT)
+    else:
+        await asyncio.wait_for(websocket.send_text(data), SEND_TIMEOUT)
+    elapsed = (time.perf_counter() - started) * 1000
+    counters = client['counters']
+    counters['frames_sent'] += 1
+    counters['bytes_sent'] += len(data)
+    counters['send_ms_last'] = elapsed
+    counters['send_ms_max'] = max(counters['send_ms_max'], elapsed)
+    counters['send_ms_total'] += elapsed
+
+async def send_backfill(websocket, client, seconds):
+    try:
+        seconds = min(float(seconds), HISTORY_SECONDS)
+    except (TypeError, ValueError):
+        return
+    message = {'type': 'backfill', 'interval': SAMPLE_INTERVAL}
+    message.update(metric_history.since(time.time() - seconds))
+    await send_data(websocket, client, encode_message(message, client['encoding']))
 
 # WebSocket endpoint to stream stats
+# Connect with ?mode=delta to receive a keyframe followed by changed fields only,
+# with ?sort=cpu|mem|pid|name&limit=N to receive only the top N processes,
+# with ?schema=2 for raw numbers without pre-formatted strings,
+# and with ?fields=cpu,memory,... to receive only the panels or fields listed.
+# Request the stats.msgpack or stats.cbor subprotocol for binary frames; JSON is the default.
+# With ?backfill=SECONDS the first message is {"type": "backfill", ...} holding the recent
+# metric history as one array per series.
+# Each client only ever waits for the newest frame, so one that falls behind skips the
+# frames it missed (counted as dropped) and one whose send stalls for SEND_TIMEOUT is
+# disconnected. Per-client counters are listed at /api/clients.
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    await initialize_static_data()  # Ensure static data is initialized
-    previous_net_io = None
+    global next_client_id
+    subprotocol = negotiate_subprotocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    next_client_id += 1
+    client_id = next_client_id
+    client = {
+        'remote': f"{websocket.client.host}:{websocket.client.port}" if websocket.client else '',
+        'connected_at': time.time(),
+        'counters': new_client_counters(),
+        'encoding': SUBPROTOCOLS.get(subprotocol, 'json'),
+        'mode': websocket.query_params.get('mode', 'full'),
+        'keyframe_requested': False,
+        'sort': DEFAULT_VIEW[0],
+        'limit': DEFAULT_VIEW[1],
+        'schema': DEFAULT_VIEW[2],
+        'fields': DEFAULT_VIEW[3],
+    }
+    parse_client_options(websocket.query_params, client)
+    ws_clients[client_id] = client
+    receiver = asyncio.create_task(receive_client_messages(websocket, client))
+    last_seq = 0
+    last_keyframe = 0
     try:
+        await send_backfill(websocket, client, websocket.query_params.get('backfill'))
         while True:
-            stats = await collect_stats(previous_net_io)
-            await websocket.send_json(stats)
-            await asyncio.sleep(1)  # Adjust the interval as needed
-            previous_net_io = stats['current_net_io']
+            frame = await wait_for_frame(last_seq)
+            if last_seq:
+                client['counters']['frames_dropped'] += frame.seq - last_seq - 1
+            view = client_view(client)
+            if client['mode'] != 'delta':
+                kind = 'full'
+            elif (client['keyframe_requested'] or frame.base_seq != last_seq
+                    or time.monotonic() - last_keyframe >= KEYFRAME_INTERVAL):
+                client['keyframe_requested'] = False
+                last_keyframe = time.monotonic()
+                kind = 'keyframe'
+            else:
+                kind = 'delta'
+            await send_data(websocket, client, frame.encode(kind, view, client['encoding']))
+            last_seq = frame.seq
     except WebSocketDisconnect:
         pass
+    except asyncio.TimeoutError:
+        # Stuck client; don't wait on its socket any further than needed to say goodbye
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), 1)
+        except Exception:
+            pass
     except Exception:
         await websocket.close()
+    finally:
+        receiver.cancel()
+        ws_clients.pop(client_id, None)
+
+# Delivery counters of the connected WebSocket clients
+@app.get("/api/clients")
+async def clients():
+    now = time.time()
+    result = []
+    for client_id, client in ws_clients.items():
+        counters = client['counters']
+        sent = counters['frames_sent']
+        result.append({
+            'id': client_id,
+            'remote': client['remote'],
+            'connected_seconds': round(now - client['connected_at'], 1),
+            'encoding': client['encoding'],
+            'mode': client['mode'],
+            'frames_sent': sent,
+            'frames_dropped': counters['frames_dropped'],
+            'bytes_sent': counters['bytes_sent'],
+            'send_ms_last': round(counters['send_ms_last'], 3),
+            'send_ms_avg': round(counters['send_ms_total'] / sent, 3) if sent else 0.0,
+            'send_ms_max': round(counters['send_ms_max'], 3),
+        })
+    return {'send_timeout': SEND_TIMEOUT, 'clients': result}
+
+# Downsampled metric history with min/max/avg/last per bucket
+@app.get("/api/rollups")
+async def rollups(
+    resolution: float = 60,
+    metrics: str = None,
+    from_: float = Query(None, alias='from'),
+    to: float = None,
+):
+    now = time.time()
+    names = set(metrics.split(',')) if metrics else None
+    start = from_ if from_ is not None else now - 3600
+    end = to if to is not None else now
+    return metric_rollups.query(start, end, resolution, names)
+
+# Latest snapshot over plain HTTP, straight from memory. Takes the same sort, limit,
+# schema (default 2 here) and fields options as the WebSocket. When fields are given,
+# only those are returned, so unchanged values revalidate with 304 across ticks.
+@app.get("/api/stats")
+async def api_stats(request: Request):
+    frame = latest_frame
+    if frame is None:
+        raise HTTPException(status_code=503, detail="No sample collected yet")
+    params = request.query_params
+    client = {'sort': DEFAULT_VIEW[0], 'limit': DEFAULT_VIEW[1], 'schema': 2, 'fields': None}
+    parse_client_options({k: v for k, v in params.items() if k != 'fields'}, client)
+    client['fields'] = resolve_fields(params.get('fields'), always=())
+    view = client_view(client)
+    etag = frame.etag(view)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'X-Sample-Timestamp': str(frame.stats['timestamp']),
+    }
+    if assets.etag_matches(request.headers.get('if-none-match', ''), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=frame.encode('full', view), media_type='application/json', headers=headers)
+
+# Prometheus text exposition of the latest snapshot, rendered at most once per tick
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+prometheus_cache = {'seq': None, 'body': ''}
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_prometheus(stats):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP stats_{name} {help_text}")
+        lines.append(f"# TYPE stats_{name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            if labels:
+                label_str = ','.join(f'{k}="{prometheus_label(v)}"' for k, v in labels.items())
+                lines.append(f"stats_{name}{{{label_str}}} {float(value)!r}")
+            else:
+                lines.append(f"stats_{name} {float(value)!r}")
+
+    metric('cpu_utilization_percent', 'gauge', 'Total CPU utilization.',
+           [({}, stats['cpu_utilization'])])
+    metric('cpu_core_utilization_percent', 'gauge', 'Utilization of each logical CPU.',
+           [({'cpu': i}, value) for i, value in enumerate(stats['per_cpu_utilization'])])
+    metric('memory_utilization_percent', 'gauge', 'Physical memory in use.',
+           [({}, stats['memory_utilization'])])
+    metric('memory_total_bytes', 'gauge', 'Total physical memory.', [({}, stats['memory_total'])])
+    metric('memory_available_bytes', 'gauge', 'Memory available to processes.',
+           [({}, stats['memory_available'])])
+    metric('memory_used_bytes', 'gauge', 'Memory in use.', [({}, stats['memory_used'])])
+    metric('swap_utilization_percent', 'gauge', 'Swap in use.', [({}, stats['swap_utilization'])])
+    mounts = [m for m in stats['disk_mounts'] if 'percent' in m]
+    metric('disk_utilization_percent', 'gauge', 'Disk space in use.',
+           [({'mountpoint': m['mountpoint']}, m['percent']) for m in mounts]
+           or [({'mountpoint': '/'}, stats['disk_utilization'])])
+    metric('filesystem_size_bytes', 'gauge', 'Filesystem size.',
+           [({'mountpoint': m['mountpoint'], 'fstype': m['fstype']}, m['total']) for m in mounts])
+    metric('filesystem_free_bytes', 'gauge', 'Filesystem space available.',
+           [({'mountpoint': m['mountpoint'], 'fstype': m['fstype']}, m['free']) for m in mounts])
+    metric('filesystem_unresponsive', 'gauge', 'Mounts whose statvfs call timed out, failed or was skipped.',
+           [({'mountpoint': m['mountpoint']}, 0 if 'percent' in m else 1) for m in stats['disk_mounts']])
+    metric('disk_read_bytes_total', 'counter', 'Bytes read from all disks.',
+           [({}, stats['disk_read_bytes'])])
+    metric('disk_written_bytes_total', 'counter', 'Bytes written to all disks.',
+           [({}, stats['disk_write_bytes'])])
+    metric('disk_read_bytes_per_second', 'gauge', 'Current read rate of all disks.',
+           [({}, stats['disk_read_rate'])])
+    metric('disk_written_bytes_per_second', 'gauge', 'Current write rate of all disks.',
+           [({}, stats['disk_write_rate'])])
+    devices = stats['disk_devices']
+    metric('disk_device_read_bytes_per_second', 'gauge', 'Current read rate per block device.',
+           [({'device': d['name']}, d['read_rate']) for d in devices])
+    metric('disk_device_written_bytes_per_second', 'gauge', 'Current write rate per block device.',
+           [({'device': d['name']}, d['write_rate']) for d in devices])
+    metric('disk_device_reads_per_second', 'gauge', 'Completed reads per second per block device.',
+           [({'device': d['name']}, d['read_iops']) for d in devices])
+    metric('disk_device_writes_per_second', 'gauge', 'Completed writes per second per block device.',
+           [({'device': d['name']}, d['write_iops']) for d in devices])
+    metric('network_transmit_bytes_total', 'counter', 'Bytes sent on all interfaces.',
+           [({}, stats['network_bytes_sent'])])
+    metric('network_receive_bytes_total', 'counter', 'Bytes received on all interfaces.',
+           [({}, stats['network_bytes_recv'])])
+    metric('network_transmit_bytes_per_second', 'gauge', 'Current upload rate.',
+           [({}, stats['network_upload_rate'])])
+    metric('network_receive_bytes_per_second', 'gauge', 'Current download rate.',
+           [({}, stats['network_download_rate'])])
+    if stats['load_avg']:
+        metric('load_average', 'gauge', 'System load average.',
+               [({'period': period}, value) for period, value in zip(('1m', '5m', '15m'), stats['load_avg'])])
+    metric('service_up', 'gauge', 'Whether a monitored systemd service is active.',
+           [({'service': name}, int(up)) for name, up in stats['service_status'].items()])
+    metric('service_probe_milliseconds', 'gauge', 'Duration of the last systemctl probe.',
+           [({}, stats['service_probe_ms'])])
+    metric('processes', 'gauge', 'Number of processes.', [({}, stats['process_count'])])
+    metric('connections', 'gauge', 'Open inet sockets by state.',
+           [({'state': state}, count) for state, count in stats['network_connections_summary']['by_state'].items()])
+    metric('uptime_seconds', 'gauge', 'Time since boot.', [({}, stats['uptime_seconds'])])
+    metric('logged_in_users', 'gauge', 'Number of logged-in users.', [({}, stats['logged_in_users'])])
+    metric('event_loop_lag_milliseconds', 'gauge', 'Worst event loop lag since the previous sample.',
+           [({}, stats['event_loop_lag_ms'])])
+    collectors = stats['collector_status'].items()
+    ages = [
+        ({'collector': name}, None if status['updated_at'] is None else stats['timestamp'] - status['updated_at'])
+        for name, status in collectors
+    ]
+    metric('collector_age_seconds', 'gauge', 'Age of the value each collector contributed.', ages)
+    metric('collector_stale', 'gauge', 'Whether a collector missed its refresh and served its last value.',
+           [({'collector': name}, int(status['stale'])) for name, status in collectors])
+    metric('collector_timeouts_total', 'counter', 'Collector runs that overran their time budget.',
+           [({'collector': name}, status['timeouts']) for name, status in collectors])
+    metric('collector_errors_total', 'counter', 'Collector runs that raised an error.',
+           [({'collector': name}, status['errors']) for name, status in collectors])
+    metric('sampler_missed_ticks_total', 'counter', 'Sampler ticks skipped because a collection overran.',
+           [({}, stats['missed_ticks'])])
+    metric('sample_timestamp_seconds', 'gauge', 'When the snapshot was taken.', [({}, stats['timestamp'])])
+    return '\n'.join(lines) + '\n'
+
+# Where the sampler's time goes: rolling p50/p95/p99 per collector and sampler step,
+# call and item counts, and CPU time. sampler.collect is the wall time a tick waits on
+# collectors; sampler.publish is the event-loop work of building and recording a frame.
+def collector_report():
+    report = collector_timings.report()
+    for name, timing in report['collectors'].items():
+        if name in collector_counters:
+            timing.update(collector_counters[name])
+    cpu_times = psutil.Process().cpu_times()
+    report['ticks'] = sampler_ticks['count']
+    report['missed_ticks'] = sampler_ticks['missed']
+    report['process_cpu_seconds'] = {'user': cpu_times.user, 'system': cpu_times.system}
+    return report
+
+# Workers don't sample, so they serve the report the collector process sent along with
+# its latest snapshot.
+@app.get("/debug/collectors")
+async def debug_collectors():
+    if not SNAPSHOT_PATH:
+        return collector_report()
+    if collector_debug['report'] is None:
+        raise HTTPException(status_code=503, detail="No snapshot from the collector yet")
+    return collector_debug['report']
+
+@app.get("/metrics")
+async def metrics():
+    frame = latest_frame
+    if frame is None:
+        return PlainTextResponse('# No sample collected yet\n', status_code=503)
+    if prometheus_cache['seq'] != frame.seq:
+        prometheus_cache['body'] = render_prometheus(frame.stats)
+        prometheus_cache['seq'] = frame.seq
+    return Response(content=prometheus_cache['body'], media_type=PROMETHEUS_CONTENT_TYPE)
+
+# Responses for closed time ranges never change, so they are kept and served with ETags
+HISTORY_MAX_POINTS = 5000
+HISTORY_CACHE_SIZE = 64
+history_cache = OrderedDict()  # query -> (etag, body)
+
+def read_history_series(name, start, end, recent):
+    """Timestamps and values of one metric from the archive, topped up with newer in-memory samples."""
+    xs = array('d')
+    ys = array('d')
+    if metric_archive is not None and name in metric_archive.names:
+        for timestamps, columns in metric_archive.read(start, end, [name]):
+            xs.frombytes(timestamps.cast('B'))
+            ys.frombytes(columns[name].cast('B'))
+    last = xs[-1] if xs else float('-inf')
+    for timestamp, value in zip(recent['timestamps'], recent['series'][name]):
+        if last < timestamp <= end:
+            xs.append(timestamp)
+            ys.append(value)
+    return xs, ys
+
+def build_history(names, start, end, points, recent):
+    series = {}
+    for name in names:
+        xs, ys = read_history_series(name, start, end, recent)
+        timestamps, values = history.lttb(xs, ys, points)
+        series[name] = {'timestamps': timestamps, 'values': values}
+    return encode_json({'from': start, 'to': end, 'points': points, 'series': series})
+
+# Recorded metric history, downsampled with LTTB to at most `points` points per series.
+# metric takes a comma separated list of names from HISTORY_METRICS.
+@app.get("/api/history")
+async def metric_history_query(
+    request: Request,
+    metric: str,
+    from_: float = Query(None, alias='from'),
+    to: float = None,
+    points: int = 600,
+):
+    now = time.time()
+    names = [name for name in metric.split(',') if name]
+    unknown = [name for name in names if name not in HISTORY_METRICS]
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {','.join(unknown) or metric}")
+    end = to if to is not None else now
+    start = from_ if from_ is not None else end - 3600
+    points = min(max(3, points), HISTORY_MAX_POINTS)
+    # No new sample can land in a range that ended before the last tick
+    closed = end < now - 2 * SAMPLE_INTERVAL
+    key = (tuple(names), start, end, points)
+
+    if closed and key in history_cache:
+        history_cache.move_to_end(key)
+        etag, body = history_cache[key]
+    else:
+        recent = metric_history.since(start, names)
+        body = await asyncio.get_running_loop().run_in_executor(
+            None, build_history, names, start, end, points, recent
+        )
+        etag = '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+        if closed:
+            history_cache[key] = (etag, body)
+            if len(history_cache) > HISTORY_CACHE_SIZE:
+                history_cache.popitem(last=False)
+
+    if not closed:
+        return Response(content=body, media_type='application/json', headers={'Cache-Control': 'no-cache'})
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=3600'}
+    if assets.etag_matches(request.headers.get('if-none-match', ''), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+# Full socket scans for /api/connections get their own threads, so clients paging through
+# connections never hold up the sampler's collectors
+connections_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='connections')
+
+# Full connection listing, one page at a time
+@app.get("/api/connections")
+async def connections(offset: int = 0, limit: int = CONNECTIONS_PAGE_SIZE, state: str = None):
+    offset = max(0, offset)
+    limit = min(max(1, limit), 1000)
+    loop = asyncio.get_running_loop()
+    if procnet.available():
+        return await loop.run_in_executor(connections_executor, procnet.list_connections, offset, limit, state)
+    rows = await loop.run_in_executor(connections_executor, get_network_connections)
+    if state is not None:
+        rows = [conn for conn in rows if conn['status'] == state]
+    return {'total': len(rows), 'offset': offset, 'limit': limit, 'connections': rows[offset:offset + limit]}
+
+# Dashboard files, kept in memory and precompressed (see assets.py)
+STATIC_DIR = os.environ.get('STATS_STATIC_DIR', '.')
+# Served with ?v=<content hash> from the page, so those URLs never need revalidating
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+static_assets = {
+    'script.min.js': assets.Asset(os.path.join(STATIC_DIR, 'script.min.js'), 'application/javascript'),
+    'styles.min.css': assets.Asset(os.path.join(STATIC_DIR, 'styles.min.css'), 'text/css'),
+}
+
+def version_asset_urls(html):
+    # Point the page at the current content of each file so it can be cached for good
+    for name, asset in static_assets.items():
+        html = html.replace(f'"{name}"'.encode(), f'"{name}?v={asset.version}"'.encode())
+    return html
+
+index_asset = assets.Asset(os.path.join(STATIC_DIR, 'index.html'), 'text/html; charset=utf-8',
+                           transform=version_asset_urls, depends=tuple(static_assets.values()))
+
+def load_assets():
+    try:
+        index_asset.refresh()
+    except OSError as e:
+        logger.warning("Dashboard files not loaded: %s", e)
+
+@app.get("/script.min.js")
+@app.get("/styles.min.css")
+async def static_asset(request: Request, v: str = None):
+    asset = static_assets[request.url.path.lstrip('/')]
+    cache_control = 'no-cache'
+    if v is not None:
+        try:
+            asset.refresh()
+        except OSError:
+            pass
+        if v == asset.version:
+            cache_control = IMMUTABLE_CACHE
+    return asset.response(request, cache_control)
 
 # Serve the HTML page
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    async with aiofiles.open('index.html', 'r') as f:
-        html_content = await f.read()
-    return HTMLResponse(content=html_content)
+async def index(request: Request):
+    return index_asset.response(request)
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ['collector']:
+        run_collector_process()
+        sys.exit()
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8003, reload=True)
+    if WORKERS > 1:
+        # Workers inherit STATS_WORKERS and so pick the same snapshot path; the collector
+        # runs beside them for the server's lifetime
+        import multiprocessing
+        collector = multiprocessing.Process(target=run_collector_process, daemon=True)
+        collector.start()
+        try:
+            uvicorn.run("main:app", host="0.0.0.0", port=8003, workers=WORKERS)
+        finally:
+            collector.terminate()
+            collector.join()
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8003, reload=True)
@@ -0,0 +1,125 @@
+# procnet.py
+# Fast connection summaries straight from /proc/net on Linux.
+# Lines are streamed and counted by their hex fields; addresses are only decoded
+# for the handful of rows that are actually reported.
+import os
+import socket
+import struct
+from collections import Counter
+
+PROC_NET_FILES = {
+    'tcp': ('/proc/net/tcp', socket.AF_INET, socket.SOCK_STREAM),
+    'tcp6': ('/proc/net/tcp6', socket.AF_INET6, socket.SOCK_STREAM),
+    'udp': ('/proc/net/udp', socket.AF_INET, socket.SOCK_DGRAM),
+    'udp6': ('/proc/net/udp6', socket.AF_INET6, socket.SOCK_DGRAM),
+}
+
+# Kernel socket states (include/net/tcp_states.h), named like psutil does
+TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+    '0C': 'NEW_SYN_RECV',
+}
+
+def available():
+    return os.path.exists(PROC_NET_FILES['tcp'][0])
+
+def state_name(proto, state_hex):
+    # UDP sockets have no connection state; psutil reports them as NONE
+    if proto.startswith('udp'):
+        return 'NONE'
+    return TCP_STATES.get(state_hex, 'UNKNOWN')
+
+def decode_address(hex_address):
+    """Decode a /proc/net 'ADDR:PORT' hex pair into (ip, port)."""
+    ip_hex, _, port_hex = hex_address.partition(':')
+    # Addresses are printed as 32-bit words in host byte order
+    words = [struct.pack('=I', int(ip_hex[i:i + 8], 16)) for i in range(0, len(ip_hex), 8)]
+    family = socket.AF_INET if len(words) == 1 else socket.AF_INET6
+    return socket.inet_ntop(family, b''.join(words)), int(port_hex, 16)
+
+def format_address(hex_address):
+    ip, port = decode_address(hex_address)
+    if port == 0 and ip in ('0.0.0.0', '::'):
+        return ''
+    return f"{ip}:{port}"
+
+def iter_sockets(protocols=None):
+    """Yield (proto, local_hex, remote_hex, state_hex) for every socket, without decoding."""
+    for proto in protocols or PROC_NET_FILES:
+        path = PROC_NET_FILES[proto][0]
+        try:
+            with open(path) as f:
+                next(f, None)  # Header line
+                for line in f:
+                    fields = line.split(None, 4)
+                    if len(fields) >= 4:
+                        yield proto, fields[1], fields[2], fields[3]
+        except OSError:
+            continue
+
+def summarize(top=10):
+    """Aggregate sockets by protocol, state, local port and remote peer."""
+    total = 0
+    by_protocol = Counter()
+    by_state = Counter()
+    by_local_port = Counter()
+    by_remote_peer = Counter()
+    for proto, local, remote, state in iter_sockets():
+        total += 1
+        by_protocol[proto] += 1
+        by_state[proto[:3], state] += 1
+        by_local_port[local[-4:]] += 1
+        remote_ip = remote[:-5]
+        if remote_ip.strip('0'):
+            by_remote_peer[remote_ip] += 1
+
+    states = Counter()
+    for (proto, state), count in by_state.items():
+        states[state_name(proto, state)] += count
+    return {
+        'total': total,
+        'by_protocol': dict(by_protocol),
+        'by_state': dict(states),
+        'top_local_ports': [
+            {'port': int(port, 16), 'count': count}
+            for port, count in by_local_port.most_common(top)
+        ],
+        'top_remote_peers': [
+            {'ip': decode_address(ip + ':0000')[0], 'count': count}
+            for ip, count in by_remote_peer.most_common(top)
+        ],
+    }
+
+def list_connections(offset=0, limit=100, state=None, count_total=True, protocols=None):
+    """Return one page of sockets in the dashboard's row format, plus the matching total.
+
+    Only rows inside the requested page are decoded. With count_total=False the scan
+    stops once the page is full and the total is reported as None.
+    """
+    rows = []
+    matched = 0
+    for proto, local, remote, state_hex in iter_sockets(protocols):
+        if not count_total and len(rows) >= limit:
+            return {'total': None, 'offset': offset, 'limit': limit, 'connections': rows}
+        status = state_name(proto, state_hex)
+        if state is not None and status != state:
+            continue
+        if offset <= matched < offset + limit:
+            rows.append({
+                'type': str(PROC_NET_FILES[proto][2]),
+                'laddr': format_address(local),
+                'raddr': format_address(remote),
+                'status': status
+            })
+        matched += 1
+    return {'total': matched, 'offset': offset, 'limit': limit, 'connections': rows}
@@ -0,0 +1,139 @@
+# snapshot.py
+# The latest stats snapshot shared between processes through one memory-mapped file,
+# normally on /dev/shm. A single collector process writes; any number of web workers read.
+#
+# Layout: a 64-byte header followed by two fixed-size slots (a double buffer).
+# Snapshot number g lives in slot g % 2. The writer announces g in `writing` before it
+# touches the slot and publishes it in `generation` once the slot is complete, so the
+# slot of the published snapshot is never being written. A reader decodes straight out
+# of the mapping and then checks `writing` again, seqlock style: if the writer has
+# since started on g + 2 (which reuses the same slot), the read is retried.
+import json
+import mmap
+import os
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b'STATSNAP'
+HEADER_SIZE = 64
+# magic, encoding, slot capacity, writing, generation, slot 0 length, slot 1 length
+HEADER_FORMAT = '<8sIIQQII'
+WRITING_OFFSET = 16
+GENERATION_OFFSET = 24
+LENGTHS_OFFSET = 32
+DEFAULT_CAPACITY = 8 * 2 ** 20  # bytes per slot
+
+ENCODING_JSON = 0
+ENCODING_MSGPACK = 1
+
+def encode(data, encoding):
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+def decode(buffer, encoding):
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.unpackb(buffer, raw=False)  # Reads the memoryview in place
+    return json.loads(bytes(buffer))
+
+class SnapshotTooLarge(ValueError):
+    pass
+
+class SnapshotWriter:
+    """Publishes snapshots into the shared file; only one writer may exist per file."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.encoding = ENCODING_MSGPACK if msgpack is not None else ENCODING_JSON
+        size = HEADER_SIZE + 2 * capacity
+        try:
+            reuse = os.path.getsize(path) == size
+        except OSError:
+            reuse = False
+        if not reuse:
+            # Build the file under a temporary name so readers never map a half-made one
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(struct.pack(HEADER_FORMAT, MAGIC, self.encoding, capacity, 0, 0, 0, 0))
+                f.truncate(size)
+            os.replace(tmp, path)
+        with open(path, 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), size)
+        # Keep counting from an existing file so attached readers see the next snapshot as new
+        magic, _, _, _, generation, _, _ = struct.unpack_from(HEADER_FORMAT, self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a stats snapshot file")
+        struct.pack_into('<II', self.map, 8, self.encoding, capacity)
+        self.capacity = capacity
+        self.generation = generation
+
+    def write(self, data):
+        """Encode and publish one snapshot; returns its generation."""
+        payload = encode(data, self.encoding)
+        if len(payload) > self.capacity:
+            raise SnapshotTooLarge(f"snapshot of {len(payload)} bytes exceeds the {self.capacity} byte slot")
+        generation = self.generation + 1
+        slot = generation % 2
+        offset = HEADER_SIZE + slot * self.capacity
+        struct.pack_into('<Q', self.map, WRITING_OFFSET, generation)
+        self.map[offset:offset + len(payload)] = payload
+        struct.pack_into('<I', self.map, LENGTHS_OFFSET + 4 * slot, len(payload))
+        struct.pack_into('<Q', self.map, GENERATION_OFFSET, generation)
+        self.generation = generation
+        return generation
+
+    def close(self):
+        self.map.close()
+
+class SnapshotReader:
+    """Reads the newest snapshot from the shared file without locking the writer out."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = os.fstat(f.fileno()).st_ino
+        magic, _, self.capacity, _, _, _, _ = struct.unpack_from(HEADER_FORMAT, self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a stats snapshot file")
+
+    @property
+    def generation(self):
+        return struct.unpack_from('<Q', self.map, GENERATION_OFFSET)[0]
+
+    def replaced(self):
+        """True when a new writer replaced the file this reader has mapped."""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return False
+
+    def read(self, last_generation=0, retries=5):
+        """Return (generation, data) for the newest snapshot, or None if it is still last_generation."""
+        for _ in range(retries):
+            generation = self.generation
+            if generation == 0 or generation == last_generation:
+                return None
+            slot = generation % 2
+            (length,) = struct.unpack_from('<I', self.map, LENGTHS_OFFSET + 4 * slot)
+            offset = HEADER_SIZE + slot * self.capacity
+            view = memoryview(self.map)[offset:offset + length]
+            (encoding,) = struct.unpack_from('<I', self.map, 8)
+            try:
+                data = decode(view, encoding)
+            except Exception:
+                data = None  # Torn read; the check below decides whether to retry
+            finally:
+                view.release()
+            writing = struct.unpack_from('<Q', self.map, WRITING_OFFSET)[0]
+            if writing <= generation + 1 and data is not None:
+                return generation, data
+        return None
+
+    def close(self):
+        self.map.close()
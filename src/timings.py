@@ -0,0 +1,71 @@
+# timings.py
+# Rolling timings of the sections of a collection pass, behind /debug/collectors in
+# every app. Each section keeps its last `samples` wall-clock durations plus
+# running totals; recording one costs two or four clock reads.
+import time
+from collections import deque
+from contextlib import contextmanager
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+class SectionTimings:
+    def __init__(self, samples=600):
+        self.samples = samples
+        self.sections = {}
+
+    @contextmanager
+    def timed(self, name, cpu=True):
+        """Time one section; set timing['items'] inside to count what it processed.
+
+        Pass cpu=False for sections that await: thread CPU time measured across an
+        await also counts whatever else the event loop ran in the meantime.
+        """
+        timing = {'items': None}
+        started = time.perf_counter()
+        cpu_started = time.thread_time() if cpu else None
+        try:
+            yield timing
+        finally:
+            seconds = time.perf_counter() - started
+            entry = self.sections.get(name)
+            if entry is None:
+                entry = self.sections[name] = {
+                    'durations': deque(maxlen=self.samples), 'calls': 0, 'seconds': 0.0,
+                    'cpu_seconds': None, 'items': 0, 'last_items': None,
+                }
+            entry['durations'].append(seconds)
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            if cpu_started is not None:
+                entry['cpu_seconds'] = (entry['cpu_seconds'] or 0.0) + time.thread_time() - cpu_started
+            if timing['items'] is not None:
+                entry['items'] += timing['items']
+                entry['last_items'] = timing['items']
+
+    def report(self):
+        """Rolling p50/p95/p99 per section, with call and item counts and CPU time."""
+        sections = {}
+        for name, entry in sorted(self.sections.items()):
+            ordered = sorted(entry['durations'])
+            cpu_seconds = entry['cpu_seconds']
+            sections[name] = {
+                'calls': entry['calls'],
+                'items': entry['items'],
+                'last_items': entry['last_items'],
+                'last_ms': round(entry['durations'][-1] * 1000, 3),
+                'mean_ms': round(entry['seconds'] / entry['calls'] * 1000, 3),
+                'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+                'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+                'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+                'max_ms': round(ordered[-1] * 1000, 3),
+                'cpu_seconds': round(cpu_seconds, 3) if cpu_seconds is not None else None,
+            }
+        return {
+            'window': self.samples,
+            'sampler_cpu_seconds': round(sum(entry['cpu_seconds'] or 0.0 for entry in self.sections.values()), 3),
+            'collectors': sections,
+        }
@@ -1,15 +1,24 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.responses import HTMLResponse
 import asyncio
+import heapq
 import psutil
 from datetime import datetime
 import platform
 import socket
+import time
 import os
 import win32service
 import win32serviceutil
 import subprocess
 import webbrowser
+import sys
+
+# Modules shared with the other apps live one directory up in a source checkout;
+# PyInstaller picks them up through the spec's pathex
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import assets
+import timings
 
 app = FastAPI()
 
@@ -150,21 +159,28 @@ def get_cpu_frequency():
     except Exception:
         return "N/A"
 
+# Per-section timings of collect_stats for /debug/collectors (see timings.py)
+collector_timings = timings.SectionTimings()
+
 # Function to collect stats
-async def collect_stats(previous_net_io):
+async def collect_stats(previous_net_io, previous_net_time=None):
     try:
         # Get service statuses
-        service_status = await get_service_status()
+        with collector_timings.timed('services', cpu=False) as timing:
+            service_status = await get_service_status()
+            timing['items'] = len(service_status)
 
         # Get utilization data using psutil
-        cpu_utilization = psutil.cpu_percent(interval=0)
-        per_cpu_utilization = psutil.cpu_percent(interval=0, percpu=True)
-        memory = psutil.virtual_memory()
-        memory_utilization = memory.percent
-        swap = psutil.swap_memory()
-        swap_utilization = swap.percent
-        disk = psutil.disk_usage('C:\\')
-        disk_utilization = disk.percent
+        with collector_timings.timed('utilization') as timing:
+            cpu_utilization = psutil.cpu_percent(interval=0)
+            per_cpu_utilization = psutil.cpu_percent(interval=0, percpu=True)
+            memory = psutil.virtual_memory()
+            memory_utilization = memory.percent
+            swap = psutil.swap_memory()
+            swap_utilization = swap.percent
+            disk = psutil.disk_usage('C:\\')
+            disk_utilization = disk.percent
+            timing['items'] = len(per_cpu_utilization)
 
         # Get uptime
         uptime_seconds = int(datetime.now().timestamp() - psutil.boot_time())
@@ -174,46 +190,53 @@ async def collect_stats(previous_net_io):
         uptime_output = f"{uptime_hours}h {uptime_minutes}m {uptime_seconds_remaining}s"
 
         # Get processes and sort by CPU utilization
-        processes = []
-        for p in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-            cpu_percent = p.info.get('cpu_percent', 0.0)
-            memory_percent = p.info.get('memory_percent', 0.0)
-            processes.append({
-                'pid': p.info['pid'],
-                'name': p.info['name'],
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory_percent
-            })
-        # Sort processes by CPU utilization descending
-        processes_sorted = sorted(processes, key=lambda x: x['cpu_percent'], reverse=True)
-        # Limit to top 10 processes to reduce data size
-        processes_sorted = processes_sorted[:10]
+        with collector_timings.timed('processes') as timing:
+            processes = []
+            for p in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
+                cpu_percent = p.info.get('cpu_percent', 0.0)
+                memory_percent = p.info.get('memory_percent', 0.0)
+                processes.append({
+                    'pid': p.info['pid'],
+                    'name': p.info['name'],
+                    'cpu_percent': cpu_percent,
+                    'memory_percent': memory_percent
+                })
+            # Select the top 10 processes by CPU utilization without sorting the whole list
+            processes_sorted = heapq.nlargest(10, processes, key=lambda x: x['cpu_percent'] or 0.0)
+            timing['items'] = len(processes)
 
         # Network info
-        net_io = psutil.net_io_counters()
-        sent_bytes = net_io.bytes_sent
-        recv_bytes = net_io.bytes_recv
-        if previous_net_io is not None:
-            sent_rate = (sent_bytes - previous_net_io.bytes_sent) / 1024  # KB/s
-            recv_rate = (recv_bytes - previous_net_io.bytes_recv) / 1024  # KB/s
-        else:
-            sent_rate = 0
-            recv_rate = 0
-        network_info = f"Upload: {sent_rate:.2f} KB/s, Download: {recv_rate:.2f} KB/s"
-        network_utilization = {'upload': sent_rate, 'download': recv_rate}
+        with collector_timings.timed('network') as timing:
+            net_io = psutil.net_io_counters()
+            net_time = time.monotonic()
+            sent_bytes = net_io.bytes_sent
+            recv_bytes = net_io.bytes_recv
+            if previous_net_io is not None and previous_net_time is not None and net_time > previous_net_time:
+                # Divide by the time actually elapsed, which is rarely exactly one second
+                elapsed = net_time - previous_net_time
+                sent_rate = max(0, sent_bytes - previous_net_io.bytes_sent) / 1024 / elapsed  # KB/s
+                recv_rate = max(0, recv_bytes - previous_net_io.bytes_recv) / 1024 / elapsed  # KB/s
+            else:
+                sent_rate = 0
+                recv_rate = 0
+            network_info = f"Upload: {sent_rate:.2f} KB/s, Download: {recv_rate:.2f} KB/s"
+            network_utilization = {'upload': sent_rate, 'download': recv_rate}
 
         # Open and active network connections
-        network_connections = get_network_connections()
-        # Format network connections
-        connections_str = "\n".join([
-            f"Proto: {conn['type']}, Local Address: {conn['laddr']}, Remote Address: {conn['raddr']}, Status: {conn['status']}"
-            for conn in network_connections if conn['status'] == 'ESTABLISHED'
-        ])
+        with collector_timings.timed('connections') as timing:
+            network_connections = get_network_connections()
+            # Format network connections
+            connections_str = "\n".join([
+                f"Proto: {conn['type']}, Local Address: {conn['laddr']}, Remote Address: {conn['raddr']}, Status: {conn['status']}"
+                for conn in network_connections if conn['status'] == 'ESTABLISHED'
+            ])
+            timing['items'] = len(network_connections)
 
         # Disk I/O stats
-        disk_io = psutil.disk_io_counters()
-        disk_read = f"{disk_io.read_bytes >> 20} MB"
-        disk_write = f"{disk_io.write_bytes >> 20} MB"
+        with collector_timings.timed('disk_io') as timing:
+            disk_io = psutil.disk_io_counters()
+            disk_read = f"{disk_io.read_bytes >> 20} MB"
+            disk_write = f"{disk_io.write_bytes >> 20} MB"
 
         # Load average (not available on Windows)
         load_avg_str = "N/A"
@@ -238,7 +261,8 @@ async def collect_stats(previous_net_io):
             'disk_read': disk_read,
             'disk_write': disk_write,
             'load_avg': load_avg_str,
-            'current_net_io': net_io  # Include for next iteration
+            'current_net_io': net_io,  # Include for next iteration
+            'current_net_time': net_time,
         }
 
         # Combine static data and dynamic stats
@@ -255,22 +279,36 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     await initialize_static_data()  # Ensure static data is initialized
     previous_net_io = None
+    previous_net_time = None
+    # Ticks are scheduled on the loop's monotonic clock so collection time doesn't
+    # stretch the period; ticks overrun by a slow collection are skipped and counted.
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    missed_ticks = 0
     try:
         while True:
-            stats = await collect_stats(previous_net_io)
-            await websocket.send_json(stats)
-            await asyncio.sleep(1)  # Adjust the interval as needed
+            stats = await collect_stats(previous_net_io, previous_net_time)
+            # A failed collection returns {}, which the page can't render; skip the tick
+            if stats:
+                stats['missed_ticks'] = missed_ticks
+                await websocket.send_json(stats)
+            next_tick += 1  # Adjust the interval as needed
+            now = loop.time()
+            if now >= next_tick:
+                missed = int(now - next_tick) + 1
+                missed_ticks += missed
+                next_tick += missed
+            await asyncio.sleep(next_tick - now)
             previous_net_io = stats.get('current_net_io')
+            previous_net_time = stats.get('current_net_time')
     except WebSocketDisconnect:
         pass
     except Exception as e:
         print(f"WebSocket error: {e}")
         await websocket.close()
 
-# Serve the HTML page
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    html_content = r"""<!DOCTYPE html>
+# The dashboard page
+INDEX_HTML = r"""<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -757,7 +795,21 @@ async def index():
 </body>
 </html>
 """
-    return HTMLResponse(content=html_content)
+# INDEX_HTML never changes while the app runs, so it is compressed once at import
+index_page = assets.Asset.from_bytes(INDEX_HTML.encode(), "text/html")
+
+# Rolling p50/p95/p99 per section of collect_stats, with call and item counts and CPU time
+@app.get("/debug/collectors")
+async def debug_collectors():
+    cpu_times = psutil.Process().cpu_times()
+    report = collector_timings.report()
+    report['process_cpu_seconds'] = {'user': cpu_times.user, 'system': cpu_times.system}
+    return report
+
+# Serve the HTML page
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    return index_page.response(request)
 
 def open_browser():
     """Open the default web browser to the application's page."""